@@ -0,0 +1,340 @@
+"""Benchmark include, merge, namespace and write with synthetic compositions.
+
+Each benchmark generates a composition with a number of services, and times
+the operation at each scale. All includes are local files, so the benchmarks
+do not use the network.
+
+Example:
+
+.. code-block:: sh
+
+    # Run all benchmarks and save the results as a baseline
+    python benchmarks/bench.py --save baseline.json
+
+    # Compare a later run against the baseline
+    python benchmarks/bench.py --compare baseline.json
+
+"""
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from compose_addons import includes
+from compose_addons import merge
+from compose_addons import namespace
+from compose_addons.config_utils import write_config
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+DEFAULT_SCALES = [10, 100, 1000, 10000]
+
+# Number of services in each included file
+SERVICES_PER_INCLUDE = 10
+
+# Maximum length of the chain of includes in a deep include tree, larger
+# compositions have more services in each file
+MAX_DEPTH = 100
+
+
+def generate_services(count, prefix='', links=3, volumes_from=2):
+    """Return a composition of ``count`` services, where each service links to,
+    and uses volumes from, some of the services defined before it.
+    """
+    def name(index):
+        return '%sservice%d' % (prefix, index)
+
+    def refs(index, num):
+        return [name(i) for i in range(max(0, index - num), index)]
+
+    services = {}
+    for index in range(count):
+        service = {
+            'image': 'example.com/%s:latest' % name(index),
+            'environment': ['INDEX=%d' % index, 'ENV=bench'],
+            'ports': ['%d:80' % (8000 + index)],
+            'volumes': ['/data/%s:/data' % name(index)],
+        }
+        if links:
+            service['links'] = [
+                '%s:alias%d' % (ref, i)
+                for i, ref in enumerate(refs(index, links))
+            ]
+        if volumes_from:
+            service['volumes_from'] = refs(index, volumes_from)
+        if index % 10 == 9:
+            service['net'] = 'container:' + name(index - 1)
+        services[name(index)] = service
+    return services
+
+
+def generate_overrides(services, layers):
+    """Return ``layers`` override configs, each changing some of the fields of
+    every other service.
+    """
+    return [
+        dict(
+            (name, {
+                'image': 'example.com/%s:layer%d' % (name, layer),
+                'environment': ['LAYER=%d' % layer],
+                'labels': {'layer': str(layer)},
+            })
+            for index, name in enumerate(sorted(services))
+            if index % 2 == layer % 2
+        )
+        for layer in range(layers)
+    ]
+
+
+class IncludeTree(object):
+    """Write a tree of included files to a temporary directory.
+
+    ``shape`` is either ``wide`` (the root includes every file) or ``deep``
+    (each file includes the next one).
+    """
+
+    def __init__(self, count, shape):
+        self.path = tempfile.mkdtemp(prefix='dcao-bench-')
+        num_files = max(1, count // SERVICES_PER_INCLUDE)
+        if shape == 'deep':
+            num_files = min(num_files, MAX_DEPTH)
+        services_per_file = max(1, count // num_files)
+        filenames = [
+            os.path.join(self.path, 'include%d.yml' % index)
+            for index in range(num_files)
+        ]
+
+        for index, filename in enumerate(filenames):
+            ns = 'ns%d' % index
+            config = generate_services(
+                services_per_file, prefix=ns + '.', volumes_from=0)
+            config['namespace'] = ns
+            if shape == 'deep' and index + 1 < num_files:
+                config['include'] = [filenames[index + 1]]
+            self.write(filename, config)
+
+        root = {'web': {'image': 'example.com/web:latest'}}
+        root['include'] = filenames if shape == 'wide' else filenames[:1]
+        self.root = root
+
+    def write(self, filename, config):
+        with open(filename, 'w') as fh:
+            write_config(config, fh)
+
+    def cleanup(self):
+        shutil.rmtree(self.path)
+
+
+def bench_include(shape):
+    def setup(count):
+        tree = IncludeTree(count, shape)
+
+        def run():
+            includes.include(dict(tree.root), {'jobs': 8})
+        return run, tree.cleanup
+    return setup
+
+
+def bench_merge_config(count):
+    base = generate_services(count)
+    overrides = generate_overrides(base, 4)
+
+    def run():
+        result = base
+        for override in overrides:
+            result = merge.merge_config(result, override)
+    return run, None
+
+
+def bench_merge_configs(count):
+    base = generate_services(count)
+    overrides = generate_overrides(base, 4)
+
+    def run():
+        merge.merge_configs(base, overrides)
+    return run, None
+
+
+def bench_deep_merge(count):
+    base = generate_services(count)
+    override, = generate_overrides(base, 1)
+
+    def run():
+        merge.deep_merge(base, override)
+    return run, None
+
+
+def bench_namespace(count):
+    config = generate_services(count, links=10, volumes_from=5)
+
+    def run():
+        namespace.add_namespace(dict(
+            (name, dict(service)) for name, service in config.items()
+        ), 'bench')
+    return run, None
+
+
+def bench_write_config(count):
+    config = generate_services(count)
+
+    def run():
+        with open(os.devnull, 'w') as fh:
+            write_config(config, fh)
+    return run, None
+
+
+BENCHMARKS = [
+    ('include-wide', bench_include('wide')),
+    ('include-deep', bench_include('deep')),
+    ('merge_config', bench_merge_config),
+    ('merge_configs', bench_merge_configs),
+    ('deep_merge', bench_deep_merge),
+    ('add_namespace', bench_namespace),
+    ('write_config', bench_write_config),
+]
+
+
+def measure(run, repeat):
+    """Return the fastest time of ``repeat`` runs, and the peak memory
+    allocated by a single run (or None if it can not be measured).
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.time()
+        run()
+        times.append(time.time() - start)
+
+    peak = None
+    if tracemalloc:
+        gc.collect()
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run_benchmarks(names, scales, repeat):
+    results = {}
+    for name, setup in BENCHMARKS:
+        if names and name not in names:
+            continue
+        for count in scales:
+            run, cleanup = setup(count)
+            try:
+                seconds, peak = measure(run, repeat)
+            finally:
+                if cleanup:
+                    cleanup()
+
+            key = '%s[%d]' % (name, count)
+            results[key] = {
+                'seconds': seconds,
+                'services_per_second': count / seconds if seconds else None,
+                'peak_memory': peak,
+            }
+            print_result(key, results[key])
+    return results
+
+
+def format_memory(value):
+    if value is None:
+        return 'n/a'
+    return '%.1fMB' % (value / 1024 / 1024)
+
+
+def print_result(key, result):
+    print('%-24s %10.4fs %14.0f services/s %10s peak' % (
+        key,
+        result['seconds'],
+        result['services_per_second'] or 0,
+        format_memory(result['peak_memory'])))
+
+
+def compare(results, baseline, threshold):
+    """Print the change from the baseline for each result, and return the
+    names of the results which are slower than ``threshold`` times the
+    baseline.
+    """
+    print()
+    print('%-24s %10s %10s %8s' % ('benchmark', 'baseline', 'current', 'ratio'))
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        before, after = baseline[key]['seconds'], results[key]['seconds']
+        ratio = after / before if before else 1
+        flag = ''
+        if ratio > threshold:
+            flag = ' REGRESSION'
+            regressions.append(key)
+        print('%-24s %9.4fs %9.4fs %7.2fx%s' % (
+            key, before, after, ratio, flag))
+    return regressions
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'benchmarks',
+        nargs='*',
+        help="Names of the benchmarks to run, defaults to all of them. One of: "
+             "%s" % ', '.join(name for name, _ in BENCHMARKS))
+    parser.add_argument(
+        '--scales',
+        type=lambda value: [int(item) for item in value.split(',')],
+        default=DEFAULT_SCALES,
+        help="Comma separated number of services to generate, defaults to "
+             "%s." % ','.join(map(str, DEFAULT_SCALES)))
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help="Number of times to run each benchmark, defaults to 3.")
+    parser.add_argument(
+        '--save',
+        help="Save the results as a baseline to this filename.")
+    parser.add_argument(
+        '--compare',
+        help="Compare the results to a baseline saved with --save.")
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=1.2,
+        help="Ratio of current to baseline time which is reported as a "
+             "regression, defaults to 1.2.")
+    return parser.parse_args(args=args)
+
+
+def main(args=None):
+    args = get_args(args=args)
+    results = run_benchmarks(args.benchmarks, args.scales, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
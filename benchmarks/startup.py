@@ -0,0 +1,108 @@
+"""Benchmark the startup time of each command line tool.
+
+Each tool is run in a new interpreter on a small local composition, the same
+way the ``console_scripts`` entry points run it. The time of an interpreter
+which does nothing is reported as a baseline.
+
+Example:
+
+.. code-block:: sh
+
+    python benchmarks/startup.py --repeat 20
+
+"""
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+COMPOSE_FILE = """
+web:
+    image: example.com/web:latest
+    links: [db]
+db:
+    image: example.com/db:latest
+"""
+
+INCLUDE_FILE = """
+namespace: other
+other.web:
+    image: example.com/other:latest
+"""
+
+ENTRY_POINT = (
+    "import sys; from compose_addons.%s import main; "
+    "sys.exit(main(sys.argv[1:]))"
+)
+
+
+def commands(path):
+    def entry_point(module, *args):
+        return [sys.executable, '-c', ENTRY_POINT % module] + list(args)
+
+    compose_file = os.path.join(path, 'docker-compose.yml')
+    include_file = os.path.join(path, 'include.yml')
+    with_includes = os.path.join(path, 'compose-with-includes.yml')
+    output = os.path.join(path, 'out.yml')
+
+    with open(compose_file, 'w') as fh:
+        fh.write(COMPOSE_FILE)
+    with open(include_file, 'w') as fh:
+        fh.write(INCLUDE_FILE)
+    with open(with_includes, 'w') as fh:
+        fh.write("include: ['%s']\n%s" % (include_file, COMPOSE_FILE))
+
+    return [
+        ('python', [sys.executable, '-c', 'pass']),
+        ('dcao-include', entry_point(
+            'includes', '-o', output, with_includes)),
+        ('dcao-namespace', entry_point(
+            'namespace', '-o', output, compose_file, 'ns')),
+        ('dcao-merge', entry_point(
+            'merge', '-o', output, compose_file, include_file)),
+    ]
+
+
+def measure(command, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call(command)
+        times.append(time.time() - start)
+    return sorted(times)
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=10,
+        help="Number of times to run each command, defaults to 10.")
+    return parser.parse_args(args=args)
+
+
+def main(args=None):
+    args = get_args(args=args)
+    path = tempfile.mkdtemp(prefix='dcao-startup-')
+    try:
+        print('%-16s %10s %10s' % ('command', 'min', 'median'))
+        for name, command in commands(path):
+            times = measure(command, args.repeat)
+            print('%-16s %8.1fms %8.1fms' % (
+                name, times[0] * 1000, times[len(times) // 2] * 1000))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Run any of the compose-addons commands.
+
+``dcao <command> [args]`` is the same as running ``dcao-<command> [args]``,
+except for ``pipeline`` which only exists as a ``dcao`` command.
+"""
+import argparse
+import importlib
+
+from compose_addons import version
+
+
+# Modules are imported when the command is run, so that each command only
+# imports what it needs
+COMMANDS = {
+    'include': 'compose_addons.includes',
+    'merge': 'compose_addons.merge',
+    'namespace': 'compose_addons.namespace',
+    'pipeline': 'compose_addons.pipeline',
+    'prefetch': 'compose_addons.prefetch',
+    'serve': 'compose_addons.serve',
+}
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser(prog='dcao', description=__doc__)
+    parser.add_argument('--version', action='version', version=version)
+    parser.add_argument(
+        'command',
+        choices=sorted(COMMANDS),
+        help="Command to run.")
+    parser.add_argument(
+        'args',
+        nargs=argparse.REMAINDER,
+        help="Arguments for the command, see dcao <command> --help.")
+    return parser.parse_args(args=args)
+
+
+def main(args=None):
+    args = get_args(args=args)
+    module = importlib.import_module(COMMANDS[args.command])
+    return module.main(args.args)
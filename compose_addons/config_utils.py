@@ -1,14 +1,330 @@
+"""Read and write configuration files.
+
+All yaml is read and written through this module, which uses the libyaml
+bindings when they are available. The output is the same with either backend.
+
+Parsed configs can be kept on disk in a ``ParseCache``, by the hash of their
+content, so unchanged files are not parsed again.
+
+Configs read with ``compact=True`` use less memory: strings are interned, so
+each distinct string is only stored once, and everything below the top level
+is immutable (``FrozenDict`` and tuples), so it can be shared between configs
+without being copied. They are written the same way as any other config.
+"""
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import six
 import yaml
+from six.moves import intern
+from yaml.constructor import SafeConstructor
+from yaml.representer import SafeRepresenter
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+
+# Increment when the parsed representation of a config changes
+PARSE_CACHE_VERSION = 1
+
+
+class FrozenDict(dict):
+    """A dict which can not be modified. Use ``dict(value)`` for a copy which
+    can be modified.
+    """
+
+    def immutable(self, *args, **kwargs):
+        raise TypeError("%s can not be modified" % type(self).__name__)
+
+    __setitem__ = __delitem__ = immutable
+    clear = pop = popitem = setdefault = update = immutable
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+
+def construct_interned_str(loader, node):
+    value = SafeConstructor.construct_yaml_str(loader, node)
+    # Only native strings can be interned on python 2
+    return intern(value) if isinstance(value, str) else value
+
+
+class CompactLoader(SafeLoader):
+    pass
 
 
-def read_config(content):
-    return yaml.safe_load(content)
+CompactLoader.add_constructor(
+    'tag:yaml.org,2002:str',
+    construct_interned_str)
+CompactLoader.add_constructor(
+    'tag:yaml.org,2002:map',
+    lambda loader, node: FrozenDict(loader.construct_mapping(node)))
+CompactLoader.add_constructor(
+    'tag:yaml.org,2002:seq',
+    lambda loader, node: tuple(loader.construct_sequence(node)))
+
+
+class Dumper(SafeDumper):
+    pass
+
+
+Dumper.add_representer(FrozenDict, SafeRepresenter.represent_dict)
+Dumper.add_representer(tuple, SafeRepresenter.represent_list)
+
+
+def read_config(content, cache=None, compact=False):
+    """Parse a config from a string or file object, using ``cache`` (a
+    ``ParseCache``) if it is set. See the module docstring for ``compact``.
+    """
+    if cache is not None:
+        if hasattr(content, 'read'):
+            content = content.read()
+        return cache.read_config(content, compact=compact)
+
+    if not compact:
+        return yaml.load(content, Loader=SafeLoader)
+
+    config = yaml.load(content, Loader=CompactLoader)
+    # The top level is modified by include and namespace, so it is not frozen
+    return dict(config) if isinstance(config, FrozenDict) else config
+
+
+def read_configs(content):
+    """Read every document in a yaml stream."""
+    return list(yaml.load_all(content, Loader=SafeLoader))
 
 
 def write_config(config, target):
+    """Write ``config`` as yaml to the file object ``target``.
+
+    A config is written one top level key at a time, so the yaml nodes for the
+    whole document are never held in memory at once. The output is the same as
+    dumping the config in one call.
+    """
+    if not isinstance(config, dict) or not config or has_shared_values(config):
+        return dump(config, target)
+
+    try:
+        keys = sorted(config)
+    except TypeError:
+        return dump(config, target)
+
+    for key in keys:
+        dump({key: config[key]}, target)
+
+
+def write_atomic(config, filename):
+    """Write the config to a temporary file, and rename it to ``filename`` so
+    that readers never see a partially written file. If ``filename`` already
+    has the same content it is not replaced, so its modification time does not
+    change. Returns True if the file was written.
+
+    If ``filename`` is a symlink, the file it links to is replaced, and the
+    link is kept. A new file is created with the permissions of the umask.
+    """
+    filename = os.path.realpath(filename)
+    dirname = os.path.dirname(filename)
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            write_config(config, fh)
+        if os.path.exists(filename):
+            if filecmp.cmp(filename, tmp_filename, shallow=False):
+                os.remove(tmp_filename)
+                return False
+            shutil.copymode(filename, tmp_filename)
+        else:
+            # mkstemp() creates the file with mode 0600
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_filename, 0o666 & ~umask)
+        os.rename(tmp_filename, filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+    return True
+
+
+def write_output(config, filename=None, diff=False):
+    """Write ``config`` to ``filename``, or stdout if it is not set or ``-``.
+    ``filename`` may also be an open file, which is written to directly.
+    With ``diff``, print the services which are different from the current
+    content of ``filename`` instead (see ``diff_services()``).
+    """
+    if hasattr(filename, 'write'):
+        return write_config(config, filename)
+
+    if diff:
+        previous = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as fh:
+                previous = read_config(fh) or {}
+        for change in diff_services(previous, config):
+            sys.stdout.write(' '.join(filter(None, change)) + '\n')
+        return
+
+    if not filename or filename == '-':
+        return write_config(config, sys.stdout)
+    write_atomic(config, filename)
+
+
+def config_hash(value):
+    """Return a stable hash of a config, or any part of one."""
+    content = json.dumps(
+        value,
+        sort_keys=True,
+        separators=(',', ':'),
+        default=str)
+    return 'sha256:' + hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def service_hashes(config):
+    """Return a dict of the name of each service to its ``config_hash()``.
+    Top level keys which are not services (``namespace`` and ``include``) are
+    skipped.
+    """
+    return dict(
+        (name, config_hash(service))
+        for name, service in config.items()
+        if isinstance(service, dict))
+
+
+def diff_services(previous, config):
+    """Compare the service hashes of two configs. Returns a sorted list of
+    ``(status, name, hash)`` for each service which is ``added``, ``changed``
+    or ``removed`` in ``config``. The hash is the new hash of the service, or
+    None if it was removed.
+    """
+    old, new = service_hashes(previous), service_hashes(config)
+    changes = []
+    for name in sorted(set(old) | set(new)):
+        if name not in new:
+            changes.append(('removed', name, None))
+        elif name not in old:
+            changes.append(('added', name, new[name]))
+        elif old[name] != new[name]:
+            changes.append(('changed', name, new[name]))
+    return changes
+
+
+def add_output_arguments(parser):
+    parser.add_argument(
+        '-o', '--output',
+        help="Output filename, defaults to stdout. An existing file is only "
+             "replaced if the output is different.")
+    parser.add_argument(
+        '--diff',
+        action='store_true',
+        help="Print the services which would be added, changed or removed in "
+             "--output, and do not write it.")
+
+
+def check_output_arguments(parser, args):
+    if args.diff and (not args.output or args.output == '-'):
+        parser.error("--diff requires --output with a filename")
+
+
+def dump(config, target):
     yaml.dump(
         config,
         stream=target,
+        Dumper=Dumper,
         indent=4,
         width=80,
         default_flow_style=False)
+
+
+def has_shared_values(config):
+    """Return True if the same list or dict is used under more than one top
+    level key of ``config``. The dumper writes these as yaml anchors and
+    aliases, which are only possible when the whole document is dumped at once.
+    """
+    owners = {}
+    for key, value in config.items():
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if not isinstance(value, (dict, list, tuple)):
+                continue
+            # Empty tuples are all the same object, but are never aliased
+            if value == ():
+                continue
+            if id(value) in owners:
+                if owners[id(value)] != key:
+                    return True
+                continue
+
+            owners[id(value)] = key
+            stack.extend(value.values() if isinstance(value, dict) else value)
+    return False
+
+
+def content_hash(content):
+    """Return the sha256 of a string or bytes."""
+    if isinstance(content, six.text_type):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+class ParseCache(object):
+    """Parsed configs stored on disk (see ``compose_addons.disk_cache``) by the
+    hash of their content. The cache is limited to ``max_size`` bytes, and the
+    least recently used configs are removed first.
+    """
+
+    def __init__(self, path, max_size=None):
+        # Local import, the disk cache is only used when it is configured
+        from compose_addons.disk_cache import DiskCache
+        self.disk_cache = DiskCache(path, max_size=max_size)
+
+    def read_config(self, content, compact=False):
+        key = 'parsed:%s:%s:%s' % (
+            PARSE_CACHE_VERSION,
+            'compact' if compact else 'plain',
+            content_hash(content))
+        entry = self.disk_cache.get(key)
+        if entry is not None:
+            return entry['config']
+
+        config = read_config(content, compact=compact)
+        self.disk_cache.set(key, {'config': config})
+        return config
+
+
+def add_read_arguments(parser):
+    group = parser.add_argument_group("read options")
+    group.add_argument(
+        '--compact',
+        action='store_true',
+        help="Intern strings and share immutable services between configs "
+             "to use less memory with large configs. The output is the same.")
+    group.add_argument(
+        '--parse-cache',
+        metavar='DIR',
+        help="Directory used to keep parsed configs between runs, so that "
+             "unchanged files are not parsed again.")
+    group.add_argument(
+        '--parse-cache-size',
+        help="Maximum size of the parse cache directory in megabytes, "
+             "defaults to 100.",
+        type=int,
+        default=100)
+
+
+def build_parse_cache(args):
+    """Return a ``ParseCache`` from the arguments added by
+    ``add_read_arguments()``, or None if it is not enabled.
+    """
+    if not args.parse_cache:
+        return None
+    return ParseCache(
+        args.parse_cache,
+        max_size=args.parse_cache_size * 1024 * 1024)
@@ -0,0 +1,140 @@
+"""A persistent cache of entries on disk, with a time-to-live for each entry and
+a bound on the total size of the cache.
+
+Each entry is stored in a separate file named by a hash of its key. Reading an
+entry updates the modification time of the file, which is used to evict the
+least recently used entries when the cache grows larger than its max size.
+"""
+import errno
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+
+# Increment when the format of cache entries changes
+CACHE_VERSION = 1
+
+PICKLE_PROTOCOL = 2
+
+
+class DiskCache(object):
+
+    def __init__(self, path, ttl=None, max_size=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        # An estimate of the total size of the entries, which is only updated
+        # by this instance. It is read from the directory by the first
+        # set(), and again each time entries are evicted.
+        self.size = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def filename(self, key):
+        return os.path.join(
+            self.path,
+            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        """Return the entry for ``key``, or None if it is not in the cache."""
+        filename = self.filename(key)
+        try:
+            with open(filename, 'rb') as fh:
+                version, entry_key, entry = pickle.load(fh)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            log.warning("Ignoring invalid cache entry %s: %s" % (filename, e))
+            return None
+
+        if version != CACHE_VERSION or entry_key != key:
+            return None
+
+        touch(filename)
+        return entry
+
+    def set(self, key, entry):
+        """Store ``entry`` for ``key``. ``entry`` must be a dict, and the time
+        it was stored is added to it as ``stored``.
+        """
+        entry = dict(entry, stored=time.time())
+        filename = self.filename(key)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump((CACHE_VERSION, key, entry), fh, PICKLE_PROTOCOL)
+            size = fh.tell()
+        old_size = file_size(filename)
+        os.rename(tmp_filename, filename)
+        self.add_size(size - old_size)
+        return entry
+
+    def refresh(self, key, entry):
+        """Reset the time-to-live of an entry which is still valid."""
+        return self.set(key, entry)
+
+    def is_fresh(self, entry):
+        if self.ttl is None:
+            return False
+        return time.time() - entry['stored'] < self.ttl
+
+    def add_size(self, size):
+        """Add ``size`` bytes to the size of the cache, and evict entries if
+        it is now larger than the max size.
+        """
+        if self.max_size is None:
+            return
+        if self.size is None:
+            return self.evict()
+        self.size += size
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        if self.max_size is None:
+            return
+
+        entries = []
+        for name in os.listdir(self.path):
+            # Skip entries which are still being written
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            remove(os.path.join(self.path, name))
+            total_size -= size
+        self.size = total_size
+
+
+def touch(filename):
+    try:
+        os.utime(filename, None)
+    except OSError:
+        pass
+
+
+def file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def remove(filename):
+    try:
+        os.remove(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
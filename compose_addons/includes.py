@@ -8,18 +8,36 @@ there are no more files to include.
 """
 import argparse
 import logging
+import os
 import sys
+import threading
+import time
+from functools import partial
 
-import requests
-import requests.exceptions
+from six.moves import queue
 from six.moves.urllib.parse import urlparse
 
+from compose_addons import stats
 from compose_addons import version
-from compose_addons.config_utils import read_config, write_config
+from compose_addons.config_utils import (
+    ParseCache,
+    add_output_arguments,
+    add_read_arguments,
+    build_parse_cache,
+    check_output_arguments,
+    content_hash,
+    read_config,
+    write_output,
+)
+from compose_addons.namespace import ReferenceIndex, service_references
+from compose_addons.stats import timed
 
 log = logging.getLogger(__name__)
 
 
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+
 class ConfigError(Exception):
     pass
 
@@ -28,23 +46,242 @@ class FetchExternalConfigError(ConfigError):
     pass
 
 
-def normalize_url(url):
+class DeadlineError(ConfigError):
+    pass
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url, base_dir=None):
+    """Parse ``url`` into a canonical form, so that every url of the same
+    config is the same key in a ``ConfigCache``. Local paths become absolute
+    ``file`` urls with symlinks resolved, and the host of http urls is
+    lowercased, without the default port. The scheme is always lowercase.
+    S3 bucket names are case sensitive, so s3 urls are not changed.
+
+    Relative paths are relative to ``base_dir``, or the working directory if
+    it is not set.
+    """
     url = urlparse(url)
-    return url if url.scheme else url._replace(scheme='file')
+    if not url.scheme or url.scheme == 'file':
+        path = os.path.realpath(os.path.join(base_dir or '', file_path(url)))
+        return url._replace(scheme='file', netloc='', path=path)
 
+    if url.scheme not in DEFAULT_PORTS or not url.hostname:
+        return url
 
-def get_project_from_file(url):
+    try:
+        port = url.port
+    except ValueError:
+        return url
+
+    host = url.hostname
+    if ':' in host:
+        host = '[%s]' % host
+    if port and port != DEFAULT_PORTS[url.scheme]:
+        host = '%s:%s' % (host, port)
+    userinfo, _, _ = url.netloc.rpartition('@')
+    return url._replace(
+        netloc='@'.join(part for part in (userinfo, host) if part),
+        path=url.path or '/')
+
+
+def include_url(entry, base_dir=None):
+    """Return the normalized url of an include entry, and a tuple of the
+    normalized urls of its mirrors. An entry is either a url, or a list of
+    urls which serve copies of the same config. The first url of a list is
+    the one used as the key of the config in a ``ConfigCache``.
+    """
+    if isinstance(entry, (list, tuple)):
+        if not entry:
+            raise ConfigError("Include entry has no urls")
+        urls = [normalize_url(url, base_dir) for url in entry]
+        return urls[0], tuple(urls[1:])
+    return normalize_url(entry, base_dir), ()
+
+
+def file_path(url):
     # Handle urls in the form file://./some/relative/path
-    path = url.netloc + url.path if url.netloc.startswith('.') else url.path
-    with open(path, 'r') as fh:
-        return read_config(fh)
+    return url.netloc + url.path if url.netloc.startswith('.') else url.path
+
+
+def get_project_from_file(url, context=None):
+    context = context or FetchContext()
+    with open(file_path(url), 'r') as fh:
+        return context.read_config(fh.read())
+
+
+class FetchContext(object):
+    """State which is shared by all the fetches in a single run."""
+
+    def __init__(
+        self,
+        disk_cache=None,
+        fetch_config=None,
+        hooks=(),
+        parse_cache=None,
+    ):
+        self.disk_cache = disk_cache
+        self.parse_cache = parse_cache
+        self.fetch_config = fetch_config or {}
+        self.hooks = list(hooks)
+        self.lock = threading.Lock()
+        # Statistics about the fetch in progress in each thread
+        self.local = threading.local()
+        self._http_session = None
+        self._s3_connection = None
+        self.s3_buckets = {}
+        # Parsed configs by the sha256 of their content
+        self.parsed = {}
+
+    @property
+    def http_session(self):
+        with self.lock:
+            if self._http_session is None:
+                self._http_session = build_http_session(self.fetch_config)
+            return self._http_session
+
+    def s3_bucket(self, name):
+        """Return the bucket named ``name``. The connection and each bucket
+        are only created once, so that the bucket is only validated once.
+        """
+        with self.lock:
+            if self._s3_connection is None:
+                self._s3_connection = build_s3_connection(self.fetch_config)
+            if name not in self.s3_buckets:
+                self.s3_buckets[name] = self._s3_connection.get_bucket(name)
+            return self.s3_buckets[name]
+
+    def read_config(self, content, size=None):
+        """Parse fetched content, and record its size and the parse time.
+
+        Parsed configs are kept by the hash of their content, so the same
+        content fetched from more than one url is only parsed once. If the
+        context has a parse cache, configs are also kept between runs.
+        """
+        start = time.time()
+        key = content_hash(content)
+        with self.lock:
+            config = self.parsed.get(key)
+        if config is None:
+            config = read_config(
+                content,
+                cache=self.parse_cache,
+                compact=self.fetch_config.get('compact', False))
+            with self.lock:
+                self.parsed[key] = config
+        self.record(
+            bytes=len(content) if size is None else size,
+            parse_seconds=time.time() - start)
+        return config
+
+    def retain_parsed(self, configs):
+        """Forget every parsed config which is not in ``configs``."""
+        ids = set(id(config) for config in configs)
+        with self.lock:
+            for key, config in list(self.parsed.items()):
+                if id(config) not in ids:
+                    del self.parsed[key]
+
+    def record(self, **fields):
+        record = getattr(self.local, 'record', None)
+        if record is not None:
+            record.update(fields)
+
+    @classmethod
+    def from_config(cls, fetch_config, hooks=()):
+        disk_cache = None
+        if fetch_config.get('cache_dir'):
+            from compose_addons.disk_cache import DiskCache
+            disk_cache = DiskCache(
+                fetch_config['cache_dir'],
+                ttl=fetch_config.get('cache_ttl'),
+                max_size=fetch_config.get('cache_max_size'))
+
+        parse_cache = None
+        if fetch_config.get('parse_cache_dir'):
+            parse_cache = ParseCache(
+                fetch_config['parse_cache_dir'],
+                max_size=fetch_config.get('parse_cache_max_size'))
+
+        return cls(
+            disk_cache=disk_cache,
+            fetch_config=fetch_config,
+            hooks=hooks,
+            parse_cache=parse_cache)
+
+
+def build_http_session(config):
+    """Return a session which keeps connections alive, and pools them by host,
+    so that includes from the same server share connections. Failed requests
+    are retried with an exponential backoff.
+    """
+    # Local imports, so that requests is only imported if an include uses it
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=config.get('retries', 3),
+        backoff_factor=config.get('retry_backoff', 0.5),
+        status_forcelist=RETRY_STATUS_CODES)
+    adapter = HTTPAdapter(
+        pool_connections=config.get('pool_size', 8),
+        pool_maxsize=config.get('pool_size', 8),
+        max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_cache_entry(context, url):
+    if not context.disk_cache:
+        return None
+    return context.disk_cache.get(url.geturl())
+
+
+def set_cache_entry(context, url, config, **validators):
+    if context.disk_cache:
+        context.record(cache='miss')
+        context.disk_cache.set(url.geturl(), dict(validators, config=config))
+    return config
+
+
+def cache_hit(context, entry):
+    context.record(cache='hit')
+    return entry['config']
+
+
+def revalidated(context, url, entry):
+    log.debug("Using cached config for %s" % url.geturl())
+    context.record(cache='revalidated')
+    context.disk_cache.refresh(url.geturl(), entry)
+    return entry['config']
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
 
 
 # TODO: integration test for this
-def get_project_from_http(url, config):
+def get_project_from_http(url, config, context=None):
+    import requests
+    context = context or FetchContext(fetch_config=config)
+    entry = get_cache_entry(context, url)
+    if entry and context.disk_cache.is_fresh(entry):
+        return cache_hit(context, entry)
+
     try:
-        response = requests.get(
+        response = context.http_session.get(
             url.geturl(),
+            headers=conditional_headers(entry),
             timeout=config.get('timeout', 20),
             verify=config.get('verify_ssl_cert', True),
             cert=config.get('ssl_cert', None),
@@ -53,7 +290,16 @@ def get_project_from_http(url, config):
     except requests.exceptions.RequestException as e:
         raise FetchExternalConfigError("Failed to include %s: %s" % (
             url.geturl(), e))
-    return read_config(response.text)
+
+    if entry and response.status_code == requests.codes.not_modified:
+        return revalidated(context, url, entry)
+
+    return set_cache_entry(
+        context,
+        url,
+        context.read_config(response.text, size=len(response.content)),
+        etag=response.headers.get('ETag'),
+        last_modified=response.headers.get('Last-Modified'))
 
 
 # Return the connection from a function, so it can be mocked in tests
@@ -63,35 +309,152 @@ def get_boto_conn():
     return boto.s3.connection.S3Connection()
 
 
-def get_project_from_s3(url):
+def build_s3_connection(config):
+    conn = get_boto_conn()
+    if config.get('timeout'):
+        conn.http_connection_kwargs['timeout'] = config['timeout']
+    return conn
+
+
+def get_project_from_s3(url, context=None):
     import boto.exception
+    context = context or FetchContext()
+    entry = get_cache_entry(context, url)
+    if entry and context.disk_cache.is_fresh(entry):
+        return cache_hit(context, entry)
+
     try:
-        conn = get_boto_conn()
-        bucket = conn.get_bucket(url.netloc)
+        bucket = context.s3_bucket(url.netloc)
     except (boto.exception.BotoServerError, boto.exception.BotoClientError) as e:
         raise FetchExternalConfigError(
             "Failed to include %s: %s" % (url.geturl(), e))
 
+    # get_key() is a HEAD request, so the etag can be compared before
+    # fetching the contents
     key = bucket.get_key(url.path)
     if not key:
         raise FetchExternalConfigError(
             "Failed to include %s: Not Found" % url.geturl())
 
-    return read_config(key.get_contents_as_string())
+    if entry and entry.get('etag') and entry['etag'] == key.etag:
+        return revalidated(context, url, entry)
+
+    return set_cache_entry(
+        context,
+        url,
+        context.read_config(key.get_contents_as_string()),
+        etag=key.etag)
 
 
-def fetch_external_config(url, fetch_config):
+def fetch_external_config(
+    url,
+    fetch_config,
+    context=None,
+    depth=None,
+    mirrors=(),
+):
+    """Fetch the config at ``url``, and send a fetch event (see
+    ``compose_addons.stats``) to the hooks of the context.
+
+    If ``mirrors`` is set, the config is also requested from each of the
+    mirror urls in order, after ``fetch_config['hedge_delay']`` seconds
+    without a response, or as soon as the url before it fails. The first
+    config to arrive is returned, and the url of the fetch event is the url
+    it came from.
+    """
+    context = context or FetchContext(fetch_config=fetch_config)
+    start = time.time()
+    if mirrors:
+        config, record = fetch_first(
+            [
+                lambda url=url: fetch_with_record(
+                    url, fetch_config, context, depth)
+                for url in (url,) + tuple(mirrors)
+            ],
+            fetch_config.get('hedge_delay'))
+    else:
+        config, record = fetch_with_record(url, fetch_config, context, depth)
+    record['seconds'] = time.time() - start
+
+    for hook in context.hooks:
+        hook.fetched(record)
+    return config
+
+
+def fetch_with_record(url, fetch_config, context, depth):
+    """Fetch the config at ``url``, and return it with the statistics of the
+    fetch.
+    """
     log.info("Fetching config from %s" % url.geturl())
+    context.local.record = record = {
+        'url': url.geturl(),
+        'depth': depth,
+        'bytes': 0,
+        'parse_seconds': 0,
+        'cache': None,
+    }
+    try:
+        config = fetch_by_scheme(url, fetch_config, context)
+    finally:
+        context.local.record = None
+    return config, record
+
+
+def fetch_first(funcs, delay=None):
+    """Call each of ``funcs`` in a new thread, and return the first result.
+    Each function is started once the one before it has run for ``delay``
+    seconds, or as soon as it fails. With a ``delay`` of None a function is
+    only started after the one before it fails. If they all fail, the error
+    of the last one to fail is raised.
+
+    Functions which are still running when a result arrives are not stopped,
+    but their results are ignored.
+    """
+    results = queue.Queue()
+
+    def run(func):
+        try:
+            results.put((True, func()))
+        except Exception as e:
+            results.put((False, e))
+
+    funcs = list(funcs)
+    running = 0
+    error = None
+    for index, func in enumerate(funcs):
+        thread = threading.Thread(target=run, args=(func,))
+        thread.daemon = True
+        thread.start()
+        running += 1
+        try:
+            success, value = results.get(timeout=delay)
+        except queue.Empty:
+            continue
+        running -= 1
+        if success:
+            return value
+        if index < len(funcs) - 1:
+            log.warning("Fetch failed, trying the next url: %s" % value)
+        error = value
+
+    while running:
+        success, value = results.get()
+        running -= 1
+        if success:
+            return value
+        error = value
+    raise error
 
+
+def fetch_by_scheme(url, fetch_config, context):
     if url.scheme in ('http', 'https'):
-        return get_project_from_http(url, fetch_config)
+        return get_project_from_http(url, fetch_config, context)
 
     if url.scheme == 'file':
-        return get_project_from_file(url)
+        return get_project_from_file(url, context)
 
-    # TODO: pass fetch_config, for timeout
     if url.scheme == 's3':
-        return get_project_from_s3(url)
+        return get_project_from_s3(url, context)
 
     raise ConfigError("Unsupported url scheme \"%s\" for %s." % (
         url.scheme,
@@ -100,53 +463,447 @@ def fetch_external_config(url, fetch_config):
 
 class ConfigCache(object):
     """Cache each config by url. Always return a new copy of the cached dict.
+
+    Configs which have been resolved (merged with all their includes) are
+    cached separately, so that an include which appears many times in the
+    include graph is only resolved once.
+
+    Relative paths in include entries are relative to ``base_dir``, or the
+    working directory if it is not set.
     """
 
-    def __init__(self, fetch_func):
+    def __init__(self, fetch_func, base_dir=None, context=None):
         self.cache = {}
+        self.resolved = {}
+        # The level of the include graph where each url was first found
+        self.depths = {}
+        # Mirror urls of each url, from include entries with more than one url
+        self.mirrors = {}
         self.fetch_func = fetch_func
+        self.base_dir = base_dir
+        # The FetchContext used by fetch_func, if it has one
+        self.context = context
+
+    def include_url(self, entry):
+        return include_url(entry, self.base_dir)
 
     def get(self, url):
         if url not in self.cache:
             self.cache[url] = self.fetch_func(url)
         return dict(self.cache[url])
 
+    def fetch_all(self, urls, map_func=map, depth=None):
+        """Fetch each url which is not already cached using ``map_func``, so
+        that the fetches can run concurrently. Return the newly fetched
+        configs.
+        """
+        urls = [url for url in unique(urls) if url not in self.cache]
+        if depth is not None:
+            for url in urls:
+                self.depths.setdefault(url, depth)
+        configs = list(map_func(self.fetch_func, urls))
+        self.cache.update(zip(urls, configs))
+        return configs
+
+    def get_resolved(self, url):
+        if url not in self.resolved:
+            return None
+        return dict(self.resolved[url])
+
+    def set_resolved(self, url, config):
+        self.resolved[url] = config
+        return dict(config)
+
+    def invalidate(self, url):
+        """Remove ``url`` from the cache, and remove the resolved config of
+        ``url`` and every config which includes it (directly or indirectly).
+        """
+        parents = {}
+        for parent, config in self.cache.items():
+            for child in config.get('include', []):
+                child, _ = self.include_url(child)
+                parents.setdefault(child, set()).add(parent)
+
+        self.cache.pop(url, None)
+        urls = [url]
+        seen = set()
+        while urls:
+            url = urls.pop()
+            if url in seen:
+                continue
+            seen.add(url)
+            self.resolved.pop(url, None)
+            urls.extend(parents.get(url, ()))
+
+
+def unique(items):
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
 
 def apply_namespace(name, namespace, service_names):
-    if name.startswith(namespace) or name not in service_names:
+    if name.startswith(namespace + '.') or name not in service_names:
         return name
     return '%s.%s' % (namespace, name)
 
 
+def namespace_services(config, namespace):
+    """Add ``namespace`` to the services of an included config which are not
+    already namespaced, and update the references to those services.
+    """
+    service_names = set(config)
+    names = dict(
+        (name, apply_namespace(name, namespace, service_names))
+        for name in config)
+    names = dict((name, new) for name, new in names.items() if name != new)
+    if not names:
+        return config
+
+    services = ReferenceIndex(config).rename(config, names)
+    return dict(
+        (names.get(name, name), service) for name, service in services.items())
+
+
 def merge_configs(base, configs):
     for config in configs:
         base.update(config)
     return base
 
 
-def fetch_includes(base_config, cache):
-    return [fetch_include(cache, url) for url in base_config.pop('include', [])]
+def fetch_includes(base_config, cache, path=()):
+    return [
+        fetch_include(cache, url, path)
+        for url in base_config.pop('include', [])
+    ]
+
+
+def fetch_include(cache, url, path=()):
+    """Fetch the config at ``url`` and merge it with all of its includes.
+
+    ``path`` is the sequence of normalized urls which included this one, and
+    is used to detect cycles in the include graph.
+    """
+    key, _ = cache.include_url(url)
+    if key in path:
+        raise ConfigError("Include cycle detected: %s" % " -> ".join(
+            item.geturl() for item in path + (key,)))
 
+    resolved = cache.get_resolved(key)
+    if resolved is not None:
+        return resolved
 
-def fetch_include(cache, url):
-    config = cache.get(normalize_url(url))
+    config = cache.get(key)
 
     namespace = config.pop('namespace', None)
     if not namespace:
         raise ConfigError("Configuration %s requires a namespace" % url)
 
-    configs = fetch_includes(config, cache)
-    return merge_configs(config, configs)
+    configs = fetch_includes(config, cache, path + (key,))
+    config = namespace_services(config, namespace)
+    return cache.set_resolved(key, merge_configs(config, configs))
 
 
-def include(base_config, fetch_config):
+def iter_include_levels(base_config, cache, jobs=1, deadline=None):
+    """Fetch the include graph of ``base_config`` into the cache one level at
+    a time, and yield the list of configs at each level. Configs which are
+    already in the cache are not fetched again, but their includes are still
+    followed. All the includes at a level which are not cached are fetched
+    concurrently using ``jobs`` threads.
+
+    If ``deadline`` is set, the whole graph must be fetched within that many
+    seconds, otherwise the fetches still running are abandoned and a
+    ``ConfigError`` lists their urls.
+    """
+    end = time.time() + deadline if deadline is not None else None
+    pool = None
+    expired = False
+    try:
+        configs = [base_config]
+        seen = set()
+        depth = 0
+        while configs:
+            depth += 1
+            urls = []
+            for config in configs:
+                for entry in config.get('include', []):
+                    url, mirrors = cache.include_url(entry)
+                    if mirrors:
+                        cache.mirrors.setdefault(url, mirrors)
+                    if url not in seen:
+                        seen.add(url)
+                        urls.append(url)
+            missing = [url for url in urls if url not in cache.cache]
+            # The thread pool is only started once there is more than one
+            # include to fetch at the same time, or when the fetches have a
+            # deadline, so that the wait can be interrupted
+            if pool is None and missing and (
+                end is not None or (jobs > 1 and len(missing) > 1)
+            ):
+                from multiprocessing.pool import ThreadPool
+                pool = ThreadPool(jobs)
+            if pool and end is not None:
+                map_func = partial(map_with_deadline, pool, end, deadline)
+            else:
+                map_func = pool.map if pool else map
+            try:
+                cache.fetch_all(missing, map_func, depth=depth)
+            except DeadlineError:
+                expired = True
+                raise
+            configs = [cache.cache[url] for url in urls]
+            if configs:
+                yield configs
+    finally:
+        if pool and expired:
+            # The worker threads can not be stopped, but they are daemon
+            # threads, so they do not keep the process running
+            pool.terminate()
+        elif pool:
+            pool.close()
+            pool.join()
+
+
+def map_with_deadline(pool, end, deadline, func, urls):
+    """Like ``pool.map()``, but raise a ``DeadlineError`` listing the urls
+    which were not fetched when the time ``end`` is reached.
+    """
+    import multiprocessing
+    done = set()
+
     def fetch(url):
-        return fetch_external_config(url, fetch_config)
+        result = func(url)
+        done.add(url)
+        return result
+
+    result = pool.map_async(fetch, urls)
+    try:
+        return result.get(max(end - time.time(), 0))
+    except multiprocessing.TimeoutError:
+        pending = [url.geturl() for url in urls if url not in done]
+        raise DeadlineError(
+            "Deadline of %gs exceeded while fetching includes, still "
+            "pending: %s" % (deadline, ", ".join(pending)))
 
-    cache = ConfigCache(fetch)
-    # Remove the namespace key from the base config, if it exists
-    base_config.pop('namespace', None)
-    return merge_configs(base_config, fetch_includes(base_config, cache))
+
+def prefetch_includes(base_config, cache, jobs=1, deadline=None):
+    """Fetch every config in the include graph of ``base_config`` into the
+    cache.
+    """
+    for _ in iter_include_levels(base_config, cache, jobs, deadline):
+        pass
+
+
+def service_closure(config, names):
+    """Return the set of services in ``names`` and every service they
+    reference (recursively), and the set of referenced names which are not
+    services in ``config``.
+    """
+    selected, missing = set(), set()
+    names = list(names)
+    while names:
+        name = names.pop()
+        if name in selected or name in missing:
+            continue
+        service = config.get(name)
+        if not isinstance(service, dict):
+            missing.add(name)
+            continue
+        selected.add(name)
+        names.extend(service_references(service))
+    return selected, missing
+
+
+def prefetch_services(base_config, cache, services, jobs=1, deadline=None):
+    """Fetch includes into the cache one level at a time, until every service
+    referenced by ``services`` has been found. Includes in the levels below
+    that are not fetched.
+    """
+    known = dict(base_config)
+    _, missing = service_closure(known, services)
+    if not missing:
+        return
+
+    for configs in iter_include_levels(base_config, cache, jobs, deadline):
+        for config in configs:
+            known.update(include_services(config))
+        _, missing = service_closure(known, services)
+        if not missing:
+            return
+    log.warning("Services not found in any include: %s" % (
+        ", ".join(sorted(missing))))
+
+
+def include_services(config):
+    """Return the services of an included config, with the names they have
+    once it is merged.
+    """
+    config = dict(config)
+    config.pop('include', None)
+    namespace = config.pop('namespace', None)
+    if not namespace:
+        return config
+    return namespace_services(config, namespace)
+
+
+def pruned_cache(cache):
+    """Return a new ``ConfigCache`` with the configs of ``cache``, without the
+    includes which are not in ``cache``. ``cache`` is not modified, so the
+    includes are fetched if a later run needs them.
+    """
+    pruned = ConfigCache(cache.fetch_func, cache.base_dir)
+    pruned.cache = dict(
+        (url, remove_unfetched_includes(config, cache))
+        for url, config in cache.cache.items())
+    return pruned
+
+
+def remove_unfetched_includes(config, cache):
+    """Return a copy of config without any includes that are not in the
+    cache.
+    """
+    if 'include' not in config:
+        return config
+    return dict(config, include=[
+        entry for entry in config['include']
+        if cache.include_url(entry)[0] in cache.cache
+    ])
+
+
+def select_services(config, services):
+    selected, _ = service_closure(config, services)
+    missing = set(services) - selected
+    if missing:
+        raise ConfigError("Services not found: %s" % ", ".join(sorted(missing)))
+    return dict((name, config[name]) for name in selected)
+
+
+def include(base_config, fetch_config, services=None, hooks=()):
+    """Merge ``base_config`` with all of its includes. If ``services`` is set,
+    only the includes required by those services (and the services they
+    reference) are fetched, and only those services are returned.
+
+    ``hooks`` receive events about each fetch and each phase of the run (see
+    ``compose_addons.stats``).
+    """
+    cache = build_config_cache(fetch_config, hooks=hooks)
+    return resolve(
+        base_config,
+        cache,
+        services=services,
+        jobs=fetch_config.get('jobs') or 1,
+        deadline=fetch_config.get('deadline'),
+        hooks=hooks)
+
+
+def build_config_cache(fetch_config, hooks=()):
+    context = FetchContext.from_config(fetch_config, hooks=hooks)
+
+    def fetch(url):
+        return fetch_external_config(
+            url,
+            fetch_config,
+            context,
+            depth=cache.depths.get(url),
+            mirrors=cache.mirrors.get(url, ()))
+
+    cache = ConfigCache(fetch, context=context)
+    return cache
+
+
+def resolve(
+    base_config,
+    cache,
+    services=None,
+    jobs=1,
+    hooks=(),
+    deadline=None,
+):
+    """Merge ``base_config`` with all of its includes using ``cache``. Only
+    the includes which are not already in the cache are fetched, within
+    ``deadline`` seconds if it is set.
+    """
+    with timed(hooks, 'fetch'):
+        if services:
+            prefetch_services(
+                base_config, cache, services, jobs=jobs, deadline=deadline)
+            base_config = remove_unfetched_includes(base_config, cache)
+            # Merge from a copy of the cache, because another run with the
+            # same cache (dcao-include --watch) may need different includes
+            cache = pruned_cache(cache)
+        else:
+            prefetch_includes(base_config, cache, jobs=jobs, deadline=deadline)
+
+    with timed(hooks, 'merge'):
+        # Remove the namespace key from the base config, if it exists
+        base_config.pop('namespace', None)
+        config = merge_configs(base_config, fetch_includes(base_config, cache))
+        if services:
+            config = select_services(config, services)
+    return config
+
+
+def add_fetch_arguments(parser):
+    fetch_group = parser.add_argument_group("fetch options")
+    fetch_group.add_argument(
+        '--timeout',
+        help="Timeout used when making network calls.",
+        type=int)
+    fetch_group.add_argument(
+        '-j', '--jobs',
+        help="Number of includes to fetch concurrently, defaults to 8.",
+        type=int,
+        default=8)
+    fetch_group.add_argument(
+        '--cache-dir',
+        help="Directory used to cache fetched http and s3 configs between "
+             "runs. Configs are not cached unless this is set.")
+    fetch_group.add_argument(
+        '--cache-ttl',
+        help="Seconds a cached config is used before it is revalidated, "
+             "defaults to 0 (always revalidate).",
+        type=int,
+        default=0)
+    fetch_group.add_argument(
+        '--cache-size',
+        help="Maximum size of the cache directory in megabytes, "
+             "defaults to 100.",
+        type=int,
+        default=100)
+    fetch_group.add_argument(
+        '--pool-size',
+        help="Maximum number of connections kept open to each http host, "
+             "defaults to 8.",
+        type=int,
+        default=8)
+    fetch_group.add_argument(
+        '--retries',
+        help="Number of times a failed http request is retried, "
+             "defaults to 3.",
+        type=int,
+        default=3)
+    fetch_group.add_argument(
+        '--retry-backoff',
+        help="Backoff factor in seconds between retries, which doubles "
+             "after each retry, defaults to 0.5.",
+        type=float,
+        default=0.5)
+    fetch_group.add_argument(
+        '--hedge-delay',
+        help="Seconds to wait for an include which lists mirror urls before "
+             "also requesting it from the next mirror. The first response is "
+             "used. By default a mirror is only used when the url before it "
+             "fails.",
+        type=float)
+    fetch_group.add_argument(
+        '--deadline',
+        help="Seconds allowed for fetching all the includes. When it is "
+             "reached the fetches still running are abandoned, and the command "
+             "fails with a list of their urls.",
+        type=float)
+    add_read_arguments(parser)
 
 
 def get_args(args=None):
@@ -157,28 +914,136 @@ def get_args(args=None):
         type=argparse.FileType('r'),
         default=sys.stdin,
         help="Path to a docker-compose configuration with includes.")
+    add_output_arguments(parser)
     parser.add_argument(
-        '-o', '--output',
-        type=argparse.FileType('w'),
-        default=sys.stdout,
-        help="Output filename, defaults to stdout.")
-    # TODO: separate argument group for fetch config args
-    parser.add_argument(
-        '--timeout',
-        help="Timeout used when making network calls.",
-        type=int)
+        '-s', '--services',
+        type=lambda value: [name for name in value.split(',') if name],
+        help="Comma separated list of services to include in the output. "
+             "The services they link to, use volumes from, or use the net "
+             "of are also included, and only the includes that are needed "
+             "for these services are fetched.")
+
+    stats_group = parser.add_argument_group("stats options")
+    stats_group.add_argument(
+        '--stats',
+        nargs='?',
+        const='text',
+        choices=['text', 'json'],
+        help="Write the fetch time, parse time, size, cache status and depth "
+             "of each include, and the total time of each phase, to stderr. "
+             "Formatted as text (the default) or json.")
+    stats_group.add_argument(
+        '--stats-hook',
+        action='append',
+        default=[],
+        metavar='MODULE:NAME',
+        help="Send stats events to a hook, created by calling NAME from "
+             "MODULE. See compose_addons.stats.Hooks. May be used more than "
+             "once.")
+
+    lock_group = parser.add_argument_group("lockfile options")
+    lock_group = lock_group.add_mutually_exclusive_group()
+    lock_group.add_argument(
+        '--lock',
+        metavar='LOCKFILE',
+        help="Write the url, hash and contents of every fetched include to "
+             "LOCKFILE, once the output has been rendered.")
+    lock_group.add_argument(
+        '--frozen',
+        type=argparse.FileType('r'),
+        metavar='LOCKFILE',
+        help="Read every include from LOCKFILE (written by --lock) instead "
+             "of fetching it. Fails if an include is missing from LOCKFILE, "
+             "or if its hash does not match.")
 
-    return parser.parse_args(args=args)
+    add_fetch_arguments(parser)
+    watch_group = parser.add_argument_group("watch options")
+    watch_group.add_argument(
+        '-w', '--watch',
+        action='store_true',
+        help="Keep running, and write the output again when the compose file "
+             "or any local include changes. Requires --output, and can not be "
+             "used with --diff, --lock, --frozen or --stats.")
+    watch_group.add_argument(
+        '--poll-interval',
+        help="Seconds between checks for changes when inotify is not "
+             "available, defaults to 0.5.",
+        type=float,
+        default=0.5)
+
+    args = parser.parse_args(args=args)
+    check_output_arguments(parser, args)
+    if args.watch and not args.output:
+        parser.error("--watch requires --output")
+    for name in ('diff', 'lock', 'frozen', 'stats'):
+        if args.watch and getattr(args, name):
+            parser.error("--%s can not be used with --watch" % name)
+    return args
+
+
+def build_hooks(args):
+    hooks = [stats.load_hook(spec) for spec in args.stats_hook]
+    if args.stats:
+        hooks.insert(0, stats.StatsCollector())
+    return hooks
+
+
+def write_stats(collector, format):
+    if format == 'json':
+        sys.stderr.write(collector.format_json() + '\n')
+    else:
+        sys.stderr.write(collector.format_text())
 
 
-# TODO: other fetch config args
 def build_fetch_config(args):
     return {
         'timeout': args.timeout,
+        'jobs': args.jobs,
+        'cache_dir': args.cache_dir,
+        'cache_ttl': args.cache_ttl,
+        'cache_max_size': args.cache_size * 1024 * 1024,
+        'pool_size': args.pool_size,
+        'retries': args.retries,
+        'retry_backoff': args.retry_backoff,
+        'parse_cache_dir': args.parse_cache,
+        'parse_cache_max_size': args.parse_cache_size * 1024 * 1024,
+        'compact': args.compact,
+        'hedge_delay': args.hedge_delay,
+        'deadline': args.deadline,
     }
 
 
 def main(args=None):
     args = get_args(args=args)
-    config = include(read_config(args.compose_file), build_fetch_config(args))
-    write_config(config, args.output)
+    if args.watch:
+        from compose_addons import watch
+        return watch.watch(args, build_fetch_config(args))
+
+    fetch_config = build_fetch_config(args)
+    hooks = build_hooks(args)
+    if args.frozen:
+        from compose_addons import lockfile
+        locked = lockfile.read_lockfile(args.frozen)
+        cache = ConfigCache(lockfile.frozen_fetch(locked))
+    else:
+        cache = build_config_cache(fetch_config, hooks=hooks)
+
+    config = resolve(
+        read_config(
+            args.compose_file,
+            cache=build_parse_cache(args),
+            compact=args.compact),
+        cache,
+        services=args.services,
+        jobs=fetch_config.get('jobs') or 1,
+        hooks=hooks,
+        deadline=fetch_config.get('deadline'))
+    with timed(hooks, 'write'):
+        write_output(config, args.output, diff=args.diff)
+
+    if args.stats:
+        write_stats(hooks[0], args.stats)
+
+    if args.lock:
+        from compose_addons import lockfile
+        lockfile.write_lockfile(cache, args.lock)
@@ -0,0 +1,76 @@
+"""Record every config fetched by ``dcao-include`` in a lockfile, and render
+from a lockfile without fetching anything.
+
+The lockfile maps each include url to the config that was fetched from it,
+and a hash of that config. The hash is verified when the lockfile is read.
+Local files are recorded relative to the current directory, so a lockfile can
+be used from another checkout of the same project.
+"""
+import os
+
+from compose_addons.config_utils import config_hash, read_config, write_output
+from compose_addons.includes import ConfigError, normalize_url
+
+
+LOCKFILE_VERSION = 1
+
+
+class LockfileError(ConfigError):
+    pass
+
+
+def lock_url(url):
+    if url.scheme == 'file':
+        return 'file:' + os.path.relpath(url.path)
+    return url.geturl()
+
+
+def build_lockfile(cache):
+    """Return a lockfile for each config in a ``ConfigCache``."""
+    return {
+        'version': LOCKFILE_VERSION,
+        'includes': dict(
+            (lock_url(url), {'hash': config_hash(config), 'config': config})
+            for url, config in cache.cache.items()
+        ),
+    }
+
+
+def write_lockfile(cache, target):
+    """Write the lockfile of ``cache`` to ``target``, a filename or an open
+    file. A file is replaced atomically, so a failed write leaves the
+    previous lockfile.
+    """
+    write_output(build_lockfile(cache), target)
+
+
+def read_lockfile(content):
+    """Read a lockfile, and return a dict of normalized url to config. Raises a
+    ``LockfileError`` if the hash of any config does not match.
+    """
+    lockfile = read_config(content) or {}
+    if lockfile.get('version') != LOCKFILE_VERSION:
+        raise LockfileError("Unsupported lockfile version %s, expected %s" % (
+            lockfile.get('version'), LOCKFILE_VERSION))
+
+    configs = {}
+    for url, entry in lockfile.get('includes', {}).items():
+        if config_hash(entry['config']) != entry['hash']:
+            raise LockfileError(
+                "Hash mismatch in lockfile for %s, expected %s" % (
+                    url, entry['hash']))
+        configs[normalize_url(url).geturl()] = entry['config']
+    return configs
+
+
+def frozen_fetch(configs):
+    """Return a fetch function for a ``ConfigCache`` which returns configs
+    from a lockfile, and never fetches them.
+    """
+    def fetch(url):
+        if url.geturl() not in configs:
+            raise LockfileError(
+                "Failed to include %s: not found in the lockfile" % (
+                    url.geturl()))
+        return configs[url.geturl()]
+    return fetch
@@ -65,40 +65,240 @@ Run:
         image: my_version_of_service_b:abf4a
 """
 import argparse
-import sys
+import os
 
-import yaml
+import six
 
+from compose_addons.config_utils import (
+    add_output_arguments,
+    add_read_arguments,
+    build_parse_cache,
+    check_output_arguments,
+    read_config,
+    write_atomic,
+    write_output,
+)
 
-def deep_merge(base, override):
-    def merge(base, override):
-        for key in set(base) | set(override):
-            value = override.get(key, base.get(key))
-            if isinstance(value, dict):
-                yield key, dict(merge(
-                    base.get(key) or {},
-                    override.get(key) or {}))
-            else:
-                yield key, value
 
-    return dict(merge(base, override))
+# A field in an override replaces this field in the configs before it
+REPLACED_FIELDS = {
+    'image': 'build',
+    'build': 'image',
+}
 
 
-def merge_config(base, override):
-    for name, service in base.items():
-        if 'build' in service and 'image' in override.get(name, {}):
-            service.pop('build')
-        if 'image' in service and 'build' in override.get(name, {}):
-            service.pop('image')
-    return deep_merge(base, override)
-
+def deep_merge(base, override):
+    return deep_merge_all([base, override])
+
+
+def deep_merge_all(configs):
+    """Merge each config onto the configs before it, in a single traversal of
+    all the configs. A dict value is merged with the dict values before it,
+    any other value replaces the values before it.
+
+    Values which are not merged with another value are shared with the config
+    they came from, not copied, so the configs must not be modified after they
+    are merged.
+    """
+    layers = {}
+    for config in configs:
+        for key, value in config.items():
+            values = layers.get(key)
+            if values and isinstance(value, dict) and isinstance(values[-1], dict):
+                values.append(value)
+            else:
+                layers[key] = [value]
+
+    return dict(
+        (key, deep_merge_all(values) if len(values) > 1 else values[0])
+        for key, values in layers.items()
+    )
+
+
+def remove_replaced_fields(configs):
+    """Return a copy of configs with any fields that are replaced by a later
+    config removed from each service (see ``REPLACED_FIELDS``).
+    """
+    replaced = {}
+    result = []
+    for index in reversed(range(len(configs))):
+        config = orig = configs[index]
+        for name, service in orig.items():
+            if not isinstance(service, dict):
+                continue
+
+            fields = replaced.get(name)
+            if fields and not fields.isdisjoint(service):
+                if config is orig:
+                    config = dict(orig)
+                config[name] = dict(
+                    (key, value) for key, value in service.items()
+                    if key not in fields)
+
+            if index > 0:
+                replaced.setdefault(name, set()).update(
+                    REPLACED_FIELDS[field]
+                    for field in service if field in REPLACED_FIELDS)
+        result.append(config)
+    return result[::-1]
+
+
+def merge_configs(base, overrides):
+    """Merge all the overrides onto base in a single pass. The result is the
+    same as merging each override onto the result of the previous one with
+    ``merge_config``.
+    """
+    return deep_merge_all(remove_replaced_fields([base] + list(overrides)))
 
-def merge_files(base, overrides, output):
-    base = yaml.load(base)
-    for override in overrides:
-        base = merge_config(base, yaml.load(override))
 
-    yaml.dump(base, output, default_flow_style=False, width=80, indent=4)
+def merge_config(base, override):
+    return merge_configs(base, [override])
+
+
+def merge_matrix(base, layers, targets):
+    """Merge a stack of overrides onto ``base`` for each target. ``layers``
+    maps the name of each override to its config, and ``targets`` maps the
+    name of each target to a list of override names. Returns a dict of target
+    name to merged config.
+
+    A stack of overrides which starts the stack of more than one target is
+    only merged once, and the result is shared by those targets.
+    """
+    counts = {}
+    for names in targets.values():
+        for end in range(1, len(names)):
+            prefix = tuple(names[:end])
+            counts[prefix] = counts.get(prefix, 0) + 1
+
+    merged = {(): base}
+
+    def merge_prefix(names):
+        if names in merged:
+            return merged[names]
+        # Start from the longest shared stack which starts this one
+        end = len(names) - 1
+        while end and counts.get(names[:end], 0) < 2:
+            end -= 1
+        config = merge_configs(
+            merge_prefix(names[:end]),
+            [layers[name] for name in names[end:]])
+        if counts.get(names, 0) > 1:
+            merged[names] = config
+        return config
+
+    return dict(
+        (target, merge_prefix(tuple(names)))
+        for target, names in targets.items()
+    )
+
+
+def read_matrix(fh):
+    """Read a matrix file, which maps each target name to a list of override
+    filenames. Raises a ``ValueError`` if it is not in this format.
+    """
+    matrix = read_config(fh) or {}
+    if not isinstance(matrix, dict):
+        raise ValueError("%s: expected a mapping of target names to lists of "
+                         "files" % fh.name)
+    for target, filenames in matrix.items():
+        if not is_target_name(target):
+            raise ValueError(
+                "%s: invalid target name %r, target names are used as "
+                "filenames in --output-dir" % (fh.name, target))
+        if not isinstance(filenames, list) or not all(
+            isinstance(filename, six.string_types) for filename in filenames
+        ):
+            raise ValueError("%s: target %s must be a list of files" % (
+                fh.name, target))
+    return matrix
+
+
+def is_target_name(name):
+    """Return True if ``name`` can be used as a filename in the output
+    directory, without a path separator or a leading ``.``.
+    """
+    if not isinstance(name, six.string_types) or not name:
+        return False
+    separators = set(['/', os.sep, os.altsep]) - set([None])
+    if any(sep in name for sep in separators):
+        return False
+    return not name.startswith('.')
+
+
+def write_target(job):
+    config, filename = job
+    write_atomic(config, filename)
+
+
+def write_targets(jobs, processes=None):
+    """Write each ``(config, filename)`` in ``jobs``, using a pool of worker
+    processes if there is more than one.
+    """
+    if processes == 1 or len(jobs) < 2:
+        for job in jobs:
+            write_target(job)
+        return
+
+    # Local import, multiprocessing is only used for a matrix
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        pool.map(write_target, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def merge_matrix_files(
+    base,
+    matrix,
+    output_dir,
+    processes=None,
+    parse_cache=None,
+    compact=False,
+):
+    """Read the base and every override in ``matrix`` once, and write
+    ``<output_dir>/<target>.yml`` for each target.
+    """
+    layers = {}
+    for filenames in matrix.values():
+        for filename in filenames:
+            if filename not in layers:
+                with open(filename, 'r') as fh:
+                    layers[filename] = read_config(
+                        fh, cache=parse_cache, compact=compact)
+
+    configs = merge_matrix(
+        read_config(base, cache=parse_cache, compact=compact),
+        layers,
+        matrix)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    write_targets(
+        [
+            (configs[target], os.path.join(output_dir, '%s.yml' % target))
+            for target in sorted(configs)
+        ],
+        processes)
+
+
+def merge_files(
+    base,
+    overrides,
+    output=None,
+    parse_cache=None,
+    compact=False,
+    diff=False,
+):
+    """Merge the override files onto the base file, and write the result to
+    ``output``, a filename or an open file (see
+    ``config_utils.write_output()``).
+    """
+    def read(fh):
+        return read_config(fh, cache=parse_cache, compact=compact)
+
+    config = merge_configs(read(base), [read(override) for override in overrides])
+    write_output(config, output, diff=diff)
 
 
 def parse_args(args):
@@ -110,19 +310,61 @@ def parse_args(args):
     parser.add_argument(
         'files',
         type=argparse.FileType('r'),
-        nargs="+",
+        nargs="*",
         help="Files to merge onto the base.")
-    parser.add_argument(
-        '-o', '--output',
-        type=argparse.FileType('w'),
-        default=sys.stdout,
-        help="Output file, defaults to stdout.")
-    return parser.parse_args(args=args)
+    add_output_arguments(parser)
+
+    matrix_group = parser.add_argument_group("matrix options")
+    matrix_group.add_argument(
+        '--matrix',
+        type=argparse.FileType('r'),
+        help="Path to a yaml file which maps target names to a list of files "
+             "to merge onto the base. Each target is written to "
+             "<output-dir>/<target>.yml.")
+    matrix_group.add_argument(
+        '--output-dir',
+        default='.',
+        help="Directory for the output of each target with --matrix, "
+             "defaults to the current directory.")
+    matrix_group.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help="Number of worker processes used to write targets with --matrix, "
+             "defaults to the number of cpus.")
+    add_read_arguments(parser)
+
+    args = parser.parse_args(args=args)
+    check_output_arguments(parser, args)
+    if args.matrix:
+        if args.files or args.output:
+            parser.error("files and --output can not be used with --matrix")
+        try:
+            args.matrix = read_matrix(args.matrix)
+        except ValueError as e:
+            parser.error(str(e))
+    elif not args.files:
+        parser.error("at least one file is required without --matrix")
+    return args
 
 
 def main(args=None):
     args = parse_args(args)
-    merge_files(args.base, args.files, args.output)
+    if args.matrix:
+        return merge_matrix_files(
+            args.base,
+            args.matrix,
+            args.output_dir,
+            processes=args.jobs,
+            parse_cache=build_parse_cache(args),
+            compact=args.compact)
+
+    merge_files(
+        args.base,
+        args.files,
+        args.output,
+        parse_cache=build_parse_cache(args),
+        compact=args.compact,
+        diff=args.diff)
 
 
 if __name__ == "__main__":
@@ -2,76 +2,158 @@
 
 Service names, links, net, and volumes from are updated to include a prefix
 and a ``namespace`` key is added to the configuration with this prefix.
+
+Many files can be namespaced in one run with ``--batch`` or ``--manifest``.
 """
 import argparse
 import sys
 from functools import partial
 
 from compose_addons import version
-from compose_addons.config_utils import read_config, write_config
+from compose_addons.config_utils import (
+    add_output_arguments,
+    add_read_arguments,
+    build_parse_cache,
+    check_output_arguments,
+    read_config,
+    write_atomic,
+    write_output,
+)
 
 
 def add_namespace(config, namespace):
-    service_names = set(config)
     prefix = namespace + '.'
-
-    def add_to_service(name, service_config):
-        namespace_links(service_config, prefix, service_names)
-        namespace_volumes_from(service_config, prefix, service_names)
-        namespace_net(service_config, prefix, service_names)
-        return prefix + name, service_config
-
+    names = dict((name, prefix + name) for name in config)
     config = dict(
-        add_to_service(service, conf)
-        for service, conf in config.items()
+        (names[name], rename_references(dict(service), names))
+        for name, service in config.items()
     )
     config['namespace'] = namespace
     return config
 
 
-def namespace_volumes_from(service, namespace, service_names):
-    def namespace_each(service):
-        if service not in service_names:
-            return service
-        return namespace + service
-
-    set_field(service, 'volumes_from', partial(list_map, namespace_each))
-
-
-def namespace_links(service, namespace, service_names):
-    def namespace_link(link):
-        service, alias = parse_field(link, 2)
-        alias = alias or service
-        if service not in service_names:
+def rename_references(service, names):
+    """Replace the ``links``, ``volumes_from`` and ``net`` references in
+    ``service`` to any service in ``names``, which maps old names to new names.
+    """
+    def rename_link(link):
+        target, _, alias = link.partition(':')
+        if target not in names:
             return link
-        return '%s:%s' % (namespace + service, alias)
-
-    set_field(service, 'links', partial(list_map, namespace_link))
-
-
-def namespace_net(service, namespace, service_names):
-    def namespace_field(value):
-        type, name = parse_field(value, 2)
-        if type != 'container' or name not in service_names:
-            return value
-        return 'container:' + namespace + name
-
-    set_field(service, 'net', namespace_field)
-
-
-def list_map(func, seq):
-    return list(map(func, seq))
-
-
-def set_field(service, field, partial_func):
-    if field not in service:
-        return
-    service[field] = partial_func(service[field])
-
-
-def parse_field(field, length):
-    parts = field.split(':', length - 1)
-    return parts + [None] * (length - len(parts))
+        return '%s:%s' % (names[target], alias or target)
+
+    def rename_volume(volume):
+        target, sep, mode = volume.partition(':')
+        if target not in names:
+            return volume
+        return names[target] + sep + mode
+
+    if service.get('links'):
+        service['links'] = [rename_link(link) for link in service['links']]
+    if service.get('volumes_from'):
+        service['volumes_from'] = [
+            rename_volume(volume) for volume in service['volumes_from']]
+
+    type, _, target = (service.get('net') or '').partition(':')
+    if type == 'container' and target in names:
+        service['net'] = 'container:' + names[target]
+    return service
+
+
+class ReferenceIndex(object):
+    """An index from each service name to the names of the services which
+    refer to it with ``links``, ``volumes_from`` or ``net``. It is built in a
+    single pass, so renaming a few services only has to patch the services
+    which refer to them, instead of scanning every service.
+    """
+
+    def __init__(self, config):
+        self.referrers = {}
+        for name, service in config.items():
+            if not isinstance(service, dict):
+                continue
+            for target in service_references(service):
+                self.referrers.setdefault(target, set()).add(name)
+
+    def rename(self, config, names):
+        """Return a copy of the services in ``config`` with every reference to
+        a service in ``names`` replaced by its new name. Only the services
+        which refer to a renamed service are copied, ``config`` is not
+        modified.
+        """
+        services = dict(config)
+        for target in names:
+            for name in self.referrers.get(target, ()):
+                if services[name] is config[name]:
+                    services[name] = rename_references(dict(config[name]), names)
+        return services
+
+
+def service_references(service):
+    """Return the names of the services referenced by the ``links``,
+    ``volumes_from`` and ``net`` fields of a service.
+    """
+    names = [link.partition(':')[0] for link in service.get('links') or []]
+    names.extend(
+        name.partition(':')[0] for name in service.get('volumes_from') or [])
+    type, _, name = (service.get('net') or '').partition(':')
+    if type == 'container':
+        names.append(name)
+    return names
+
+
+def namespace_file(job, parse_cache=None, compact=False):
+    """Namespace a single file. ``job`` is a tuple of the filename, namespace
+    and output filename. Returns the job and an error message, or None if it
+    succeeded.
+    """
+    filename, namespace, output = job
+    try:
+        with open(filename, 'r') as fh:
+            config = add_namespace(
+                read_config(fh, cache=parse_cache, compact=compact),
+                namespace)
+        write_atomic(config, output)
+    except Exception as e:
+        return job, '%s: %s' % (type(e).__name__, e)
+    return job, None
+
+
+def namespace_files(jobs, processes=None, parse_cache=None, compact=False):
+    """Namespace each file in ``jobs`` using a pool of worker processes.
+    Returns a list of ``(job, error)`` for each job which failed.
+    """
+    func = partial(namespace_file, parse_cache=parse_cache, compact=compact)
+    if processes == 1 or len(jobs) < 2:
+        results = map(func, jobs)
+        return [(job, error) for job, error in results if error]
+
+    # Local import, multiprocessing is only used for batches
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(func, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return [(job, error) for job, error in results if error]
+
+
+def read_manifest(fh):
+    """Read jobs from a manifest. Each line of the manifest has a filename,
+    namespace, and output filename separated by whitespace. Blank lines and
+    lines starting with ``#`` are ignored.
+    """
+    for lineno, line in enumerate(fh, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        if len(fields) != 3:
+            raise ValueError(
+                "%s:%s: expected \"file namespace output\", got \"%s\"" % (
+                    fh.name, lineno, line))
+        yield tuple(fields)
 
 
 def get_args(args=None):
@@ -80,21 +162,68 @@ def get_args(args=None):
     parser.add_argument(
         'compose_file',
         type=argparse.FileType('r'),
-        default=sys.stdin,
+        nargs='?',
         help="Path to a docker-compose configuration to namespace.")
     parser.add_argument(
         'namespace',
+        nargs='?',
         help="Namespace to add to all service names.")
-    parser.add_argument(
-        '-o', '--output',
-        type=argparse.FileType('w'),
-        default=sys.stdout,
-        help="Output filename, defaults to stdout.")
-
-    return parser.parse_args(args=args)
+    add_output_arguments(parser)
+
+    batch_group = parser.add_argument_group("batch options")
+    batch_group.add_argument(
+        '--batch',
+        nargs=3,
+        action='append',
+        default=[],
+        metavar=('FILE', 'NAMESPACE', 'OUTPUT'),
+        help="Namespace FILE with NAMESPACE and write it to OUTPUT. May be "
+             "used more than once.")
+    batch_group.add_argument(
+        '--manifest',
+        type=argparse.FileType('r'),
+        help="Path to a file where each line is a FILE NAMESPACE OUTPUT to "
+             "namespace.")
+    batch_group.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help="Number of worker processes used to namespace files in a batch, "
+             "defaults to the number of cpus.")
+    add_read_arguments(parser)
+
+    args = parser.parse_args(args=args)
+    check_output_arguments(parser, args)
+    if args.manifest:
+        try:
+            args.batch.extend(read_manifest(args.manifest))
+        except ValueError as e:
+            parser.error(str(e))
+    if bool(args.compose_file) != bool(args.namespace):
+        parser.error("compose_file and namespace must be used together")
+    if not args.batch and not args.compose_file:
+        parser.error("compose_file and namespace are required without "
+                     "--batch or --manifest")
+    return args
 
 
 def main(args=None):
     args = get_args(args=args)
-    config = add_namespace(read_config(args.compose_file), args.namespace)
-    write_config(config, args.output)
+    parse_cache = build_parse_cache(args)
+    if args.compose_file:
+        config = add_namespace(
+            read_config(args.compose_file, cache=parse_cache, compact=args.compact),
+            args.namespace)
+        write_output(config, args.output, diff=args.diff)
+
+    if not args.batch:
+        return
+
+    failed = namespace_files(
+        [tuple(job) for job in args.batch],
+        args.jobs,
+        parse_cache=parse_cache,
+        compact=args.compact)
+    for (filename, _, _), error in failed:
+        sys.stderr.write("Failed to namespace %s: %s\n" % (filename, error))
+    if failed:
+        return 1
@@ -0,0 +1,116 @@
+"""Run include, namespace and merge on a docker-compose configuration in a
+single process.
+
+The stages run in the order include, namespace, merge, on the parsed config,
+so the yaml is only read once and written once. Each stage is optional, and
+does the same thing as the ``dcao-include``, ``dcao-namespace`` and
+``dcao-merge`` command it replaces.
+
+Example:
+
+.. code-block:: sh
+
+    # the same as
+    #   dcao-include compose.yml | dcao-namespace - myservice | \\
+    #       dcao-merge - overrides.yml
+    dcao pipeline --include --namespace myservice --merge overrides.yml \\
+        compose.yml
+"""
+import argparse
+
+from compose_addons import includes
+from compose_addons import version
+from compose_addons.config_utils import (
+    add_output_arguments,
+    build_parse_cache,
+    check_output_arguments,
+    read_config,
+    write_output,
+)
+from compose_addons.merge import merge_configs
+from compose_addons.namespace import add_namespace
+
+
+def pipeline(
+    config,
+    include=False,
+    fetch_config=None,
+    services=None,
+    namespace=None,
+    overrides=(),
+):
+    """Run each stage on ``config`` and return the result.
+
+    :param include: if True, merge the includes of ``config`` using
+        ``fetch_config``, and only keep ``services`` if it is set
+    :param namespace: if set, add this namespace to every service
+    :param overrides: configs to merge onto the result, in order
+    """
+    if include:
+        config = includes.include(config, fetch_config or {}, services=services)
+    if namespace:
+        config = add_namespace(config, namespace)
+    if overrides:
+        config = merge_configs(config, overrides)
+    return config
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog='dcao pipeline',
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--version', action='version', version=version)
+    parser.add_argument(
+        'compose_file',
+        type=argparse.FileType('r'),
+        help="Path to a docker-compose configuration.")
+    add_output_arguments(parser)
+
+    stage_group = parser.add_argument_group("stages")
+    stage_group.add_argument(
+        '--include',
+        action='store_true',
+        help="Merge the includes of the configuration (dcao-include).")
+    stage_group.add_argument(
+        '-s', '--services',
+        type=lambda value: [name for name in value.split(',') if name],
+        help="With --include, comma separated list of services to include in "
+             "the output (see dcao-include --services).")
+    stage_group.add_argument(
+        '--namespace',
+        help="Add this namespace to all service names (dcao-namespace).")
+    stage_group.add_argument(
+        '--merge',
+        type=argparse.FileType('r'),
+        action='append',
+        default=[],
+        metavar='FILE',
+        help="Merge FILE onto the configuration (dcao-merge). May be used "
+             "more than once.")
+    includes.add_fetch_arguments(parser)
+
+    args = parser.parse_args(args=args)
+    check_output_arguments(parser, args)
+    if not (args.include or args.namespace or args.merge):
+        parser.error("at least one of --include, --namespace or --merge is "
+                     "required")
+    if args.services and not args.include:
+        parser.error("--services requires --include")
+    return args
+
+
+def main(args=None):
+    args = get_args(args=args)
+    parse_cache = build_parse_cache(args)
+    config = pipeline(
+        read_config(args.compose_file, cache=parse_cache, compact=args.compact),
+        include=args.include,
+        fetch_config=includes.build_fetch_config(args),
+        services=args.services,
+        namespace=args.namespace,
+        overrides=[
+            read_config(override, cache=parse_cache, compact=args.compact)
+            for override in args.merge
+        ])
+    write_output(config, args.output, diff=args.diff)
@@ -0,0 +1,84 @@
+"""Fetch the include graph of one or more compositions into the fetch and parse
+caches, without merging or writing anything.
+
+Run it before ``dcao-include`` (for example while building an image, or when a
+machine starts) so that the first render does not wait for the network. Use
+the same cache options as the ``dcao-include`` runs which should use the
+caches.
+
+Each root may be a local path or the url of a composition. The includes of all
+the roots are fetched together, one level of the include graph at a time.
+
+Example:
+
+.. code-block:: sh
+
+    dcao-prefetch --cache-dir ~/.cache/dcao --parse-cache ~/.cache/dcao-parsed \\
+        compose.yml http://example.com/compositions/servicea.yaml
+"""
+import argparse
+import sys
+
+from compose_addons import version
+from compose_addons.includes import (
+    ConfigCache,
+    FetchContext,
+    add_fetch_arguments,
+    build_fetch_config,
+    fetch_external_config,
+    prefetch_includes,
+)
+
+
+def prefetch(roots, fetch_config):
+    """Fetch every config in the include graphs of ``roots``. Returns the
+    ``ConfigCache`` of fetched configs, and a dict of url to an error message
+    for each config which could not be fetched. The includes of a config which
+    failed are not fetched, but the rest of the graph is.
+    """
+    context = FetchContext.from_config(fetch_config)
+    failed = {}
+
+    def fetch(url):
+        try:
+            return fetch_external_config(
+                url, fetch_config, context, mirrors=cache.mirrors.get(url, ()))
+        except Exception as e:
+            failed[url.geturl()] = '%s: %s' % (type(e).__name__, e)
+            return {}
+
+    cache = ConfigCache(fetch)
+    prefetch_includes(
+        {'include': roots},
+        cache,
+        jobs=fetch_config.get('jobs') or 1,
+        deadline=fetch_config.get('deadline'))
+    return cache, failed
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--version', action='version', version=version)
+    parser.add_argument(
+        'roots',
+        nargs='+',
+        metavar='composition',
+        help="Path or url of a composition to prefetch.")
+    add_fetch_arguments(parser)
+
+    args = parser.parse_args(args=args)
+    if not (args.cache_dir or args.parse_cache):
+        parser.error("at least one of --cache-dir or --parse-cache is required")
+    return args
+
+
+def main(args=None):
+    args = get_args(args=args)
+    cache, failed = prefetch(args.roots, build_fetch_config(args))
+    for url, error in sorted(failed.items()):
+        sys.stderr.write("Failed to fetch %s: %s\n" % (url, error))
+    sys.stderr.write("Fetched %s configs\n" % (len(cache.cache) - len(failed)))
+    if failed:
+        return 1
@@ -0,0 +1,253 @@
+"""Serve include, merge and namespace requests over http.
+
+The server keeps fetched configs, http and s3 connections, and imported
+modules warm between requests, so requests which share includes only fetch
+them once. It listens on a local tcp port or a unix socket.
+
+Each request is a ``POST`` with a yaml body, and the response is the yaml
+result:
+
+``/include?services=web,db&dir=/path/to/project``
+    the body is a composition with includes. ``services`` is optional, and
+    has the same meaning as ``dcao-include --services``. ``dir`` is the
+    absolute path of the directory that relative local includes are relative
+    to, usually the working directory of the client. Without it, relative
+    includes are relative to the working directory of the server.
+``/namespace?namespace=myservice``
+    the body is a composition to namespace.
+``/merge``
+    the body is a yaml stream of documents (separated by ``---``), the first is
+    the base and the rest are merged onto it in order.
+
+Example:
+
+.. code-block:: sh
+
+    dcao-serve --socket /tmp/dcao.sock &
+    curl --unix-socket /tmp/dcao.sock --data-binary @compose.yml \\
+        http://localhost/include
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+import yaml
+from six import StringIO
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.parse import urlparse
+
+from compose_addons import version
+from compose_addons.config_utils import read_config, read_configs, write_config
+from compose_addons.includes import (
+    ConfigCache,
+    ConfigError,
+    FetchContext,
+    add_fetch_arguments,
+    build_fetch_config,
+    fetch_external_config,
+    resolve,
+)
+from compose_addons.merge import merge_configs
+from compose_addons.namespace import add_namespace
+
+log = logging.getLogger(__name__)
+
+
+class RequestError(Exception):
+    pass
+
+
+class Renderer(object):
+    """Handle requests using configs and connections which are shared by
+    every request. Fetched http and s3 configs are kept for ``config_ttl``
+    seconds. Local files are read again by every request, so a request always
+    sees the current content of the file.
+    """
+
+    def __init__(self, fetch_config, config_ttl=60):
+        self.fetch_config = fetch_config
+        self.context = FetchContext.from_config(fetch_config)
+        self.config_ttl = config_ttl
+        self.lock = threading.Lock()
+        self.configs = {}
+
+    def fetch(self, url, mirrors=()):
+        shared = url.scheme != 'file'
+        if shared:
+            with self.lock:
+                entry = self.configs.get(url)
+            if entry and time.time() - entry[0] < self.config_ttl:
+                return entry[1]
+
+        config = fetch_external_config(
+            url, self.fetch_config, self.context, mirrors=mirrors)
+        with self.lock:
+            if shared:
+                self.configs[url] = (time.time(), config)
+            # Only keep the parsed content of configs which are still shared
+            self.context.retain_parsed(
+                config for _, config in self.configs.values())
+        return config
+
+    def include(self, config, services=None, base_dir=None):
+        if base_dir and not os.path.isabs(base_dir):
+            raise RequestError("dir must be an absolute path: %s" % base_dir)
+        # Each request has its own cache, which reads from the shared configs
+        cache = ConfigCache(
+            lambda url: self.fetch(url, cache.mirrors.get(url, ())),
+            base_dir=base_dir)
+        return resolve(
+            config,
+            cache,
+            services=services,
+            jobs=self.fetch_config.get('jobs') or 1,
+            deadline=self.fetch_config.get('deadline'))
+
+    def namespace(self, config, namespace):
+        return add_namespace(config, namespace)
+
+    def merge(self, configs):
+        if not configs:
+            raise RequestError("merge requires at least one document")
+        return merge_configs(configs[0], configs[1:])
+
+    def handle(self, path, query, body):
+        """Return the result of a request. ``query`` is a dict of query
+        parameters to lists of values, like ``parse_qs()`` returns.
+        """
+        if path == '/include':
+            services = ','.join(query.get('services', [])).split(',')
+            return self.include(
+                read_config(body) or {},
+                services=[name for name in services if name],
+                base_dir=(query.get('dir') or [None])[0])
+
+        if path == '/namespace':
+            if not query.get('namespace'):
+                raise RequestError("namespace requires a namespace parameter")
+            return self.namespace(read_config(body) or {}, query['namespace'][0])
+
+        if path == '/merge':
+            return self.merge(read_configs(body))
+
+        return None
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    server_version = 'dcao-serve/' + version
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        try:
+            config = self.server.renderer.handle(
+                url.path, parse_qs(url.query), body)
+        except (
+            ConfigError,
+            EnvironmentError,
+            RequestError,
+            yaml.YAMLError,
+        ) as e:
+            return self.respond(400, '%s\n' % e)
+        except Exception as e:
+            log.exception("Failed to handle %s" % self.path)
+            return self.respond(500, '%s: %s\n' % (type(e).__name__, e))
+
+        if config is None:
+            return self.respond(404, 'Not Found: %s\n' % url.path)
+
+        output = StringIO()
+        write_config(config, output)
+        self.respond(200, output.getvalue(), 'application/x-yaml')
+
+    def respond(self, code, content, content_type='text/plain'):
+        content = content.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        if not self.client_address:
+            return 'unix'
+        return BaseHTTPServer.BaseHTTPRequestHandler.address_string(self)
+
+    def log_message(self, format, *args):
+        log.info("%s %s" % (self.address_string(), format % args))
+
+
+class HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def build_server(renderer, socket_path=None, host='127.0.0.1', port=8080):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = HTTPServer((host, port), RequestHandler)
+    server.renderer = renderer
+    return server
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--version', action='version', version=version)
+    listen_group = parser.add_mutually_exclusive_group()
+    listen_group.add_argument(
+        '--socket',
+        help="Path of a unix socket to listen on.")
+    listen_group.add_argument(
+        '--port',
+        type=int,
+        default=8080,
+        help="Local tcp port to listen on, defaults to 8080.")
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help="Address to listen on with --port, defaults to 127.0.0.1.")
+    parser.add_argument(
+        '--config-ttl',
+        type=int,
+        default=60,
+        help="Seconds a fetched config is shared between requests before it "
+             "is fetched again, defaults to 60.")
+    add_fetch_arguments(parser)
+    return parser.parse_args(args=args)
+
+
+def main(args=None):
+    args = get_args(args=args)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    renderer = Renderer(build_fetch_config(args), config_ttl=args.config_ttl)
+    server = build_server(
+        renderer,
+        socket_path=args.socket,
+        host=args.host,
+        port=args.port)
+    log.info("Listening on %s" % (
+        args.socket or '%s:%s' % (args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
@@ -0,0 +1,125 @@
+"""Statistics about where ``dcao-include`` spends its time.
+
+Hooks receive an event after each include is fetched, and after each phase of
+a run (fetching all the includes, merging, and writing the output). The
+``StatsCollector`` hook aggregates these events for ``--stats``. Other hooks
+can be used to forward the same events elsewhere (for example to a metrics
+pipeline) with ``--stats-hook module:name``.
+
+Each fetch event is a dict with the keys:
+
+``url``
+    the normalized url of the include
+``depth``
+    the level of the include graph where the include was first found (1 for
+    the includes of the base config), or None if it is not known
+``seconds``
+    total time to fetch and parse the include
+``bytes``
+    size of the fetched content (0 if the content was not transferred)
+``parse_seconds``
+    time spent parsing the yaml
+``cache``
+    ``hit`` if the include was read from the disk cache, ``revalidated`` if
+    the cached include was unchanged, ``miss`` if it was not in the cache or
+    had changed, or None if the disk cache is disabled
+"""
+from __future__ import division
+
+import importlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Hooks(object):
+    """Base class for hooks. Override either method to receive events."""
+
+    def fetched(self, event):
+        """Called after each include is fetched, from the thread which fetched
+        it.
+        """
+
+    def phase(self, name, seconds):
+        """Called after each phase of a run."""
+
+
+@contextmanager
+def timed(hooks, name):
+    start = time.time()
+    yield
+    seconds = time.time() - start
+    for hook in hooks:
+        hook.phase(name, seconds)
+
+
+def load_hook(spec):
+    """Return a hook from a ``module:name`` spec, where ``name`` is a class or
+    function that takes no arguments and returns a hook.
+    """
+    module_name, _, name = spec.partition(':')
+    if not name:
+        raise ValueError("Invalid hook %s, expected module:name" % spec)
+    return getattr(importlib.import_module(module_name), name)()
+
+
+class StatsCollector(Hooks):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fetches = []
+        self.phases = {}
+
+    def fetched(self, event):
+        with self.lock:
+            self.fetches.append(dict(event))
+
+    def phase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def totals(self):
+        cache = [fetch['cache'] for fetch in self.fetches]
+        return dict(
+            self.phases,
+            includes=len(self.fetches),
+            bytes=sum(fetch['bytes'] for fetch in self.fetches),
+            fetch_seconds=sum(fetch['seconds'] for fetch in self.fetches),
+            parse_seconds=sum(fetch['parse_seconds'] for fetch in self.fetches),
+            cache_hits=cache.count('hit') + cache.count('revalidated'),
+            cache_misses=cache.count('miss'))
+
+    def as_dict(self):
+        return {
+            'fetches': sorted(
+                self.fetches,
+                key=lambda fetch: (fetch['depth'] or 0, fetch['url'])),
+            'totals': self.totals(),
+        }
+
+    def format_json(self):
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+    def format_text(self):
+        lines = ['%5s %9s %9s %10s %-11s %s' % (
+            'depth', 'fetch', 'parse', 'bytes', 'cache', 'url')]
+        for fetch in self.as_dict()['fetches']:
+            lines.append('%5s %8.3fs %8.3fs %10d %-11s %s' % (
+                fetch['depth'] or '-',
+                fetch['seconds'],
+                fetch['parse_seconds'],
+                fetch['bytes'],
+                fetch['cache'] or '-',
+                fetch['url']))
+
+        totals = self.totals()
+        lines.append('')
+        lines.append(
+            'includes: %(includes)d, bytes: %(bytes)d, '
+            'cache hits: %(cache_hits)d, cache misses: %(cache_misses)d' % (
+                totals))
+        for name in ['fetch', 'merge', 'write']:
+            if name in totals:
+                lines.append('%s: %.3fs' % (name, totals[name]))
+        return '\n'.join(lines) + '\n'
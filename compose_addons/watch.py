@@ -0,0 +1,183 @@
+"""Watch a composition and its local includes, and write the included config
+again each time one of the files changes.
+
+The include graph is kept in memory between changes. When a file changes,
+only that file is fetched again, and only the includes which include it
+(directly or indirectly) are merged again.
+
+Changes are detected with inotify when the ``inotify_simple`` package is
+installed, otherwise each file is polled for changes.
+"""
+import logging
+import os
+import time
+
+import yaml
+
+from compose_addons.config_utils import read_config, write_atomic
+from compose_addons.includes import (
+    ConfigError,
+    build_config_cache,
+    file_path,
+    resolve,
+)
+
+log = logging.getLogger(__name__)
+
+
+class Renderer(object):
+    """Render a composition with includes to an output file, keeping the
+    include graph cached between renders.
+    """
+
+    def __init__(self, compose_file, output, fetch_config, services=None):
+        self.compose_file = os.path.abspath(compose_file)
+        self.output = output
+        self.services = services
+        self.jobs = fetch_config.get('jobs') or 1
+        self.deadline = fetch_config.get('deadline')
+        self.cache = build_config_cache(fetch_config)
+        self.base_config = None
+        # Paths which changed, but have not been rendered successfully
+        self.pending = set()
+
+    def paths(self):
+        """Return the paths of the compose file and every local include."""
+        paths = set([self.compose_file]) | self.pending
+        paths.update(
+            os.path.abspath(file_path(url))
+            for url in self.cache.cache
+            if url.scheme == 'file')
+        return paths
+
+    def invalidate(self, paths):
+        """Remove each of ``paths`` from the cache, so they are read again by
+        the next render.
+        """
+        for url in list(self.cache.cache):
+            if url.scheme != 'file':
+                continue
+            if os.path.abspath(file_path(url)) in paths:
+                self.cache.invalidate(url)
+        if self.compose_file in paths:
+            self.base_config = None
+        self.pending.update(paths)
+
+    def render(self):
+        if self.base_config is None:
+            with open(self.compose_file, 'r') as fh:
+                self.base_config = read_config(fh)
+
+        config = resolve(
+            dict(self.base_config),
+            self.cache,
+            services=self.services,
+            jobs=self.jobs,
+            deadline=self.deadline)
+        write_atomic(config, self.output)
+        self.pending.clear()
+        # Forget the parsed content of old versions of the changed files
+        self.cache.context.retain_parsed(self.cache.cache.values())
+
+
+class PollingWatcher(object):
+    """Detect changes to files by comparing their modification times."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.mtimes = {}
+
+    def wait(self, paths):
+        """Block until any of ``paths`` changes, and return the changed paths.
+        """
+        self.mtimes = dict(
+            (path, self.mtimes.get(path, get_mtime(path))) for path in paths)
+        while True:
+            changed = self.poll()
+            if changed:
+                return changed
+            time.sleep(self.interval)
+
+    def poll(self):
+        changed = set()
+        for path, mtime in self.mtimes.items():
+            current = get_mtime(path)
+            if current != mtime:
+                self.mtimes[path] = current
+                changed.add(path)
+        return changed
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class InotifyWatcher(object):
+    """Detect changes to files with inotify. The directory of each file is
+    watched, so that files which are replaced by a rename (as many editors do)
+    are still detected.
+    """
+
+    # Milliseconds to wait for more events after the first change, so that a
+    # burst of events is handled as a single change
+    debounce = 50
+
+    def __init__(self):
+        import inotify_simple
+        self.flags = (
+            inotify_simple.flags.CLOSE_WRITE |
+            inotify_simple.flags.MOVED_TO |
+            inotify_simple.flags.CREATE)
+        self.inotify = inotify_simple.INotify()
+        self.dirs = {}
+
+    def wait(self, paths):
+        for dirname in set(os.path.dirname(path) for path in paths):
+            if dirname not in self.dirs.values():
+                wd = self.inotify.add_watch(dirname, self.flags)
+                self.dirs[wd] = dirname
+
+        while True:
+            events = self.inotify.read()
+            events.extend(self.inotify.read(timeout=self.debounce))
+            changed = set(
+                os.path.join(self.dirs[event.wd], event.name)
+                for event in events
+                if event.wd in self.dirs
+            ) & set(paths)
+            if changed:
+                return changed
+
+
+def get_watcher(poll_interval):
+    try:
+        return InotifyWatcher()
+    except (ImportError, OSError) as e:
+        log.info("Polling for changes, inotify is not available: %s" % e)
+        return PollingWatcher(poll_interval)
+
+
+def watch(args, fetch_config):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    output = args.output
+    renderer = Renderer(
+        args.compose_file.name,
+        output,
+        fetch_config,
+        services=args.services)
+    watcher = get_watcher(args.poll_interval)
+
+    while True:
+        try:
+            start = time.time()
+            renderer.render()
+            log.info("Wrote %s in %.3fs" % (output, time.time() - start))
+        except (ConfigError, EnvironmentError, yaml.YAMLError) as e:
+            log.error("Failed to render %s: %s" % (output, e))
+
+        changed = watcher.wait(renderer.paths())
+        log.info("Changed: %s" % ", ".join(sorted(changed)))
+        renderer.invalidate(changed)
@@ -25,12 +25,16 @@ setup(
     ],
     extras_require={
         's3': ['boto'],
+        'watch': ['inotify_simple'],
     },
     entry_points={
         'console_scripts': [
+            'dcao = compose_addons.cli:main',
             'dcao-include = compose_addons.includes:main',
             'dcao-namespace = compose_addons.namespace:main',
             'dcao-merge = compose_addons.merge:main',
+            'dcao-serve = compose_addons.serve:main',
+            'dcao-prefetch = compose_addons.prefetch:main',
         ],
     },
 )
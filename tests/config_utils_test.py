@@ -0,0 +1,286 @@
+import argparse
+import os
+import stat
+import textwrap
+
+import mock
+import pytest
+import yaml
+from six import StringIO
+
+from compose_addons import config_utils
+
+
+@pytest.fixture
+def config():
+    return {
+        'web': {
+            'image': 'example.com/web:latest',
+            'command': 'echo "%s"\nexit 0' % ('x' * 100),
+            'environment': ['A=1', u'B=ünicode'],
+            'ports': [80, '8080:80'],
+            'links': [],
+            'labels': {},
+            'restart': None,
+        },
+        'db': {'image': 'example.com/db:latest', 'privileged': True},
+    }
+
+
+def test_read_config():
+    content = textwrap.dedent("""
+        web:
+            image: example.com/web:latest
+            ports: [80]
+    """)
+    assert config_utils.read_config(content) == {
+        'web': {'image': 'example.com/web:latest', 'ports': [80]},
+    }
+
+
+def test_read_config_is_safe():
+    with pytest.raises(yaml.YAMLError):
+        config_utils.read_config("!!python/object/apply:os.system ['true']")
+
+
+def test_write_config(config):
+    output = StringIO()
+    config_utils.write_config(config, output)
+    assert yaml.safe_load(output.getvalue()) == config
+
+
+@pytest.mark.skipif(
+    not hasattr(yaml, 'CSafeDumper'),
+    reason="libyaml is not available")
+def test_write_config_same_output_for_each_backend(config):
+    def dump(dumper):
+        return yaml.dump(
+            config,
+            Dumper=dumper,
+            indent=4,
+            width=80,
+            default_flow_style=False)
+
+    output = StringIO()
+    config_utils.write_config(config, output)
+    assert output.getvalue() == dump(yaml.SafeDumper) == dump(yaml.CSafeDumper)
+
+
+def dump(config):
+    return yaml.dump(
+        config,
+        Dumper=config_utils.SafeDumper,
+        indent=4,
+        width=80,
+        default_flow_style=False)
+
+
+@pytest.mark.parametrize('value', [
+    {},
+    None,
+    'scalar',
+    ['a', 'b'],
+    {'web': {'image': 'web'}, 1: 'mixed key types'},
+])
+def test_write_config_not_streamed(value):
+    output = StringIO()
+    config_utils.write_config(value, output)
+    assert output.getvalue() == dump(value)
+
+
+def test_write_config_streamed_same_output(config):
+    config['namespace'] = 'star'
+    output = StringIO()
+    config_utils.write_config(config, output)
+    assert output.getvalue() == dump(config)
+
+
+def test_write_config_shared_values_use_aliases():
+    environment = ['A=1']
+    config = {
+        'web': {'environment': environment},
+        'db': {'environment': environment},
+    }
+    output = StringIO()
+    config_utils.write_config(config, output)
+    assert output.getvalue() == dump(config)
+    assert '&id001' in output.getvalue()
+
+
+def test_has_shared_values():
+    shared = ['A=1']
+    assert config_utils.has_shared_values({'a': {'x': shared}, 'b': shared})
+    assert not config_utils.has_shared_values({'a': {'x': shared, 'y': shared}})
+    assert not config_utils.has_shared_values({'a': ['A=1'], 'b': ['A=1']})
+
+
+def test_has_shared_values_recursive():
+    value = []
+    value.append(value)
+    assert not config_utils.has_shared_values({'a': value})
+
+
+class TestParseCache(object):
+
+    @pytest.fixture
+    def cache(self, tmpdir):
+        return config_utils.ParseCache(str(tmpdir.join('cache')))
+
+    def test_read_config_is_cached(self, cache):
+        content = "web: {image: example.com/web}"
+        expected = {'web': {'image': 'example.com/web'}}
+        assert config_utils.read_config(content, cache=cache) == expected
+
+        with mock.patch('yaml.load', autospec=True) as mock_load:
+            assert config_utils.read_config(content, cache=cache) == expected
+        assert not mock_load.called
+
+    def test_read_config_from_file(self, cache, tmpdir):
+        tmpdir.join('compose.yml').write("web: {}")
+        with tmpdir.join('compose.yml').open() as fh:
+            assert config_utils.read_config(fh, cache=cache) == {'web': {}}
+
+    def test_changed_content_is_parsed(self, cache):
+        assert config_utils.read_config("a: 1", cache=cache) == {'a': 1}
+        assert config_utils.read_config("a: 2", cache=cache) == {'a': 2}
+
+
+def test_content_hash():
+    assert (config_utils.content_hash(u'a: 1') ==
+            config_utils.content_hash(b'a: 1'))
+
+
+class TestCompact(object):
+
+    content = textwrap.dedent("""
+        web:
+            image: example.com/shared-image:latest
+            links: [db]
+            environment: {A: '1'}
+            volumes: []
+        db:
+            image: example.com/shared-image:latest
+            ports: []
+    """)
+
+    def test_read_config(self):
+        config = config_utils.read_config(self.content, compact=True)
+        assert type(config) is dict
+        assert isinstance(config['web'], config_utils.FrozenDict)
+        assert config['web']['links'] == ('db',)
+        assert config['web']['image'] is config['db']['image']
+
+    def test_services_can_not_be_modified(self):
+        config = config_utils.read_config(self.content, compact=True)
+        with pytest.raises(TypeError):
+            config['web']['image'] = 'other'
+        with pytest.raises(TypeError):
+            config['web'].update(image='other')
+        assert dict(config['web'], image='other')['image'] == 'other'
+
+    def test_write_config_same_output(self):
+        compact, plain = StringIO(), StringIO()
+        config_utils.write_config(
+            config_utils.read_config(self.content, compact=True), compact)
+        config_utils.write_config(config_utils.read_config(self.content), plain)
+        assert compact.getvalue() == plain.getvalue()
+
+    def test_parse_cache(self, tmpdir):
+        cache = config_utils.ParseCache(str(tmpdir))
+        for _ in range(2):
+            config = config_utils.read_config(
+                self.content, cache=cache, compact=True)
+            assert isinstance(config['web'], config_utils.FrozenDict)
+        plain = config_utils.read_config(self.content, cache=cache)
+        assert type(plain['web']) is dict
+
+
+def test_has_shared_values_empty_tuples():
+    assert not config_utils.has_shared_values({'a': (), 'b': ()})
+
+
+def test_write_atomic_keeps_mode(tmpdir):
+    output = tmpdir.join('out.yml')
+    output.write('old')
+    os.chmod(str(output), 0o600)
+    assert config_utils.write_atomic({'web': {'image': 'web'}}, str(output))
+    assert yaml.safe_load(output.read()) == {'web': {'image': 'web'}}
+    assert stat.S_IMODE(os.stat(str(output)).st_mode) == 0o600
+    assert tmpdir.listdir() == [output]
+
+
+def test_write_atomic_unchanged(tmpdir):
+    output = tmpdir.join('out.yml')
+    config = {'web': {'image': 'web'}}
+    config_utils.write_atomic(config, str(output))
+    os.utime(str(output), (1, 1))
+
+    assert not config_utils.write_atomic(config, str(output))
+    assert os.stat(str(output)).st_mtime == 1
+    assert tmpdir.listdir() == [output]
+
+
+def test_write_atomic_new_file_uses_umask(tmpdir):
+    output = tmpdir.join('out.yml')
+    umask = os.umask(0o077)
+    try:
+        config_utils.write_atomic({'web': {}}, str(output))
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(str(output)).st_mode) == 0o600
+
+
+def test_write_atomic_keeps_symlink(tmpdir):
+    target = tmpdir.mkdir('target').join('out.yml')
+    target.write('old')
+    link = tmpdir.join('out.yml')
+    link.mksymlinkto(target)
+    assert config_utils.write_atomic({'web': {}}, str(link))
+    assert link.islink()
+    assert yaml.safe_load(target.read()) == {'web': {}}
+
+
+def test_service_hashes_are_stable():
+    first = config_utils.service_hashes(
+        {'web': {'image': 'web', 'ports': [80]}, 'db': {}})
+    second = config_utils.service_hashes(
+        {'db': {}, 'web': {'ports': (80,), 'image': 'web'}})
+    assert first == second
+    assert first['web'] != first['db']
+    assert first['web'].startswith('sha256:')
+
+
+def test_service_hashes_skip_non_services():
+    config = {'namespace': 'a', 'include': ['b.yml'], 'a.web': {}}
+    assert list(config_utils.service_hashes(config)) == ['a.web']
+
+
+def test_diff_services():
+    previous = {'web': {'image': 'web:1'}, 'db': {}, 'old': {}}
+    config = {'web': {'image': 'web:2'}, 'db': {}, 'new': {}}
+    hashes = config_utils.service_hashes(config)
+    assert config_utils.diff_services(previous, config) == [
+        ('added', 'new', hashes['new']),
+        ('removed', 'old', None),
+        ('changed', 'web', hashes['web']),
+    ]
+
+
+def test_write_output_diff(tmpdir, capsys):
+    output = tmpdir.join('out.yml')
+    output.write("web: {image: 'web:1'}\n")
+    config = {'web': {'image': 'web:2'}}
+
+    config_utils.write_output(config, str(output), diff=True)
+    out, _ = capsys.readouterr()
+    assert out == 'changed web %s\n' % config_utils.config_hash(config['web'])
+    assert output.read() == "web: {image: 'web:1'}\n"
+
+
+@pytest.mark.parametrize('output', [[], ['-o', '-']])
+def test_check_output_arguments_diff_requires_a_filename(output):
+    parser = argparse.ArgumentParser()
+    config_utils.add_output_arguments(parser)
+    args = parser.parse_args(['--diff'] + output)
+    with pytest.raises(SystemExit):
+        config_utils.check_output_arguments(parser, args)
@@ -0,0 +1,73 @@
+import os
+
+import mock
+import pytest
+
+from compose_addons.disk_cache import DiskCache
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return DiskCache(str(tmpdir.join('cache')), ttl=60, max_size=None)
+
+
+def test_get_missing(cache):
+    assert cache.get('http://example.com/a.yml') is None
+
+
+def test_set_and_get(cache):
+    key = 'http://example.com/a.yml'
+    cache.set(key, {'config': {'a': 1}, 'etag': 'abc'})
+    entry = cache.get(key)
+    assert entry['config'] == {'a': 1}
+    assert entry['etag'] == 'abc'
+    assert cache.is_fresh(entry)
+
+
+def test_get_invalid_entry(cache):
+    key = 'http://example.com/a.yml'
+    with open(cache.filename(key), 'wb') as fh:
+        fh.write(b'not a pickle')
+    assert cache.get(key) is None
+
+
+def test_is_fresh_expired(cache):
+    with mock.patch('compose_addons.disk_cache.time.time', return_value=100):
+        entry = cache.set('key', {})
+    with mock.patch('compose_addons.disk_cache.time.time', return_value=200):
+        assert not cache.is_fresh(entry)
+
+
+def test_is_fresh_no_ttl(tmpdir):
+    cache = DiskCache(str(tmpdir), ttl=None)
+    assert not cache.is_fresh(cache.set('key', {}))
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = DiskCache(str(tmpdir), max_size=None)
+    for index, key in enumerate(['a', 'b', 'c']):
+        cache.set(key, {'config': 'x' * 100})
+        os.utime(cache.filename(key), (index, index))
+    size = os.path.getsize(cache.filename('a'))
+
+    cache.get('a')
+    cache.max_size = size * 2
+    cache.evict()
+
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+
+def test_set_only_scans_when_over_max_size(tmpdir):
+    cache = DiskCache(str(tmpdir), max_size=10000)
+    with mock.patch.object(cache, 'evict', wraps=cache.evict) as mock_evict:
+        for key in ['a', 'b', 'c']:
+            cache.set(key, {'config': 'x' * 100})
+        assert mock_evict.call_count == 1
+
+        cache.set('d', {'config': 'x' * 10000})
+        assert mock_evict.call_count == 2
+    assert cache.size <= cache.max_size
+    assert cache.size == sum(
+        os.path.getsize(str(path)) for path in tmpdir.listdir())
@@ -0,0 +1,109 @@
+import mock
+import pytest
+import yaml
+from six import StringIO
+
+from compose_addons import includes
+from compose_addons import lockfile
+from compose_addons.includes import ConfigCache, normalize_url
+from compose_addons.lockfile import LockfileError
+
+
+@pytest.fixture
+def cache():
+    configs = {
+        'http://example.com/a.yml': {'namespace': 'a', 'a.web': {'image': 'a'}},
+        's3://bucket/b.yml': {'namespace': 'b', 'b.web': {'image': 'b'}},
+    }
+    cache = ConfigCache(lambda url: configs[url.geturl()])
+    for url in configs:
+        cache.get(normalize_url(url))
+    return cache
+
+
+def write_lockfile(cache):
+    output = StringIO()
+    lockfile.write_lockfile(cache, output)
+    return output.getvalue()
+
+
+def test_write_and_read_lockfile(cache):
+    configs = lockfile.read_lockfile(write_lockfile(cache))
+    assert configs == dict(
+        (url.geturl(), config) for url, config in cache.cache.items())
+
+
+def test_read_lockfile_hash_mismatch(cache):
+    content = yaml.safe_load(write_lockfile(cache))
+    content['includes']['s3://bucket/b.yml']['config']['b.web'] = {}
+    with pytest.raises(LockfileError) as exc:
+        lockfile.read_lockfile(yaml.safe_dump(content))
+    assert "Hash mismatch in lockfile for s3://bucket/b.yml" in str(exc.value)
+
+
+def test_read_lockfile_bad_version():
+    with pytest.raises(LockfileError) as exc:
+        lockfile.read_lockfile("version: 99\nincludes: {}")
+    assert "Unsupported lockfile version 99" in str(exc.value)
+
+
+def test_frozen_fetch_missing():
+    fetch = lockfile.frozen_fetch({})
+    with pytest.raises(LockfileError) as exc:
+        fetch(normalize_url('http://example.com/missing.yml'))
+    expected = ("Failed to include http://example.com/missing.yml: "
+                "not found in the lockfile")
+    assert expected in str(exc.value)
+
+
+def test_lockfile_local_files_are_relative(tmpdir):
+    configs = {'a.yml': {'namespace': 'a'}}
+    with tmpdir.as_cwd():
+        cache = ConfigCache(lambda url: configs['a.yml'])
+        cache.get(normalize_url('./a.yml'))
+        content = write_lockfile(cache)
+        assert list(yaml.safe_load(content)['includes']) == ['file:a.yml']
+        assert lockfile.read_lockfile(content) == {
+            normalize_url('a.yml').geturl(): {'namespace': 'a'}}
+
+
+@pytest.mark.acceptance
+def test_lock_and_frozen_end_to_end(tmpdir, capsys):
+    tmpdir.join('compose.yml').write("""
+        include: ['./a.yml']
+        web:
+            image: example/web:latest
+            links: ['a.api']
+    """)
+    tmpdir.join('a.yml').write("""
+        namespace: a
+        a.api:
+            image: example/a:latest
+    """)
+
+    with tmpdir.as_cwd():
+        includes.main(args=['--lock', 'compose.lock', 'compose.yml'])
+        locked_out, _ = capsys.readouterr()
+        tmpdir.join('a.yml').remove()
+
+        with mock.patch(
+            'compose_addons.includes.fetch_external_config',
+            autospec=True,
+        ) as mock_fetch:
+            includes.main(args=['--frozen', 'compose.lock', 'compose.yml'])
+        frozen_out, _ = capsys.readouterr()
+
+    assert not mock_fetch.called
+    assert frozen_out == locked_out
+    assert yaml.safe_load(frozen_out)['a.api'] == {
+        'image': 'example/a:latest'}
+
+
+@pytest.mark.acceptance
+def test_lockfile_not_written_when_include_fails(tmpdir):
+    tmpdir.join('compose.yml').write("include: ['./a.yml']\nweb: {}\n")
+    tmpdir.join('compose.lock').write('previous')
+    with tmpdir.as_cwd():
+        with pytest.raises(EnvironmentError):
+            includes.main(args=['--lock', 'compose.lock', 'compose.yml'])
+    assert tmpdir.join('compose.lock').read() == 'previous'
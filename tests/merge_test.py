@@ -1,7 +1,9 @@
 import textwrap
 
+import mock
 import pytest
 import yaml
+from six import StringIO
 
 from compose_addons import merge
 
@@ -52,6 +54,73 @@ def test_merge_file_image_to_build():
     assert merge.merge_config(base, override) == expected
 
 
+def test_deep_merge():
+    base = {
+        'a': {'b': {'c': 1, 'd': 2}, 'e': [1]},
+        'f': 'base',
+        'g': None,
+    }
+    override = {
+        'a': {'b': {'c': 3}, 'e': [2]},
+        'f': {'now': 'a dict'},
+        'g': {'h': 1},
+    }
+    assert merge.deep_merge(base, override) == {
+        'a': {'b': {'c': 3, 'd': 2}, 'e': [2]},
+        'f': {'now': 'a dict'},
+        'g': {'h': 1},
+    }
+
+
+def test_deep_merge_all():
+    configs = [
+        {'a': {'b': 1, 'c': {'d': 1}}},
+        {'a': {'c': {'e': 2}}},
+        {'a': None},
+        {'a': {'f': 3}},
+        {'a': {'g': 4}, 'h': 5},
+    ]
+    assert merge.deep_merge_all(configs) == {'a': {'f': 3, 'g': 4}, 'h': 5}
+
+
+def test_deep_merge_all_shares_unchanged_values():
+    base = {'a': {'b': {'c': 1}, 'd': {'e': 1}}, 'f': {'g': 1}}
+    override = {'a': {'d': {'h': 2}}}
+    result = merge.deep_merge_all([base, override])
+    assert result == {'a': {'b': {'c': 1}, 'd': {'e': 1, 'h': 2}}, 'f': {'g': 1}}
+    assert result is not base
+    assert result['a'] is not base['a']
+    assert result['a']['b'] is base['a']['b']
+    assert result['f'] is base['f']
+
+
+def test_merge_configs_build_and_image_many_overrides():
+    base = {
+        'web': {'build': '.', 'ports': ['80']},
+        'db': {'image': 'db:latest'},
+        'worker': {'build': 'worker/'},
+    }
+    overrides = [
+        {'web': {'image': 'web:latest'}, 'db': {'build': 'db/'}},
+        {'web': {'build': 'web/'}, 'db': {'environment': ['A=1']}},
+        {'worker': {'build': 'other/', 'image': 'worker:latest'}},
+    ]
+    expected = {
+        'web': {'build': 'web/', 'ports': ['80']},
+        'db': {'build': 'db/', 'environment': ['A=1']},
+        'worker': {'build': 'other/', 'image': 'worker:latest'},
+    }
+    assert merge.merge_configs(base, overrides) == expected
+
+
+def test_merge_configs_does_not_modify_inputs():
+    base = {'web': {'build': '.'}}
+    override = {'web': {'image': 'web:latest'}}
+    merge.merge_configs(base, [override])
+    assert base == {'web': {'build': '.'}}
+    assert override == {'web': {'image': 'web:latest'}}
+
+
 @pytest.mark.acceptance
 def test_merge_end_to_end(tmpdir, capsys):
     tmpdir.join('base.yaml').write(textwrap.dedent("""
@@ -94,4 +163,110 @@ def test_merge_end_to_end(tmpdir, capsys):
         merge.main(['base.yaml', 'overrides.yaml'])
 
     out, err = capsys.readouterr()
-    assert yaml.load(out) == expected
+    assert yaml.safe_load(out) == expected
+
+
+@pytest.mark.acceptance
+def test_merge_with_parse_cache(tmpdir, capsys):
+    tmpdir.join('base.yaml').write("web: {image: web}\n")
+    tmpdir.join('overrides.yaml').write("web: {command: run}\n")
+
+    args = ['--parse-cache', 'cache', 'base.yaml', 'overrides.yaml']
+    with tmpdir.as_cwd():
+        merge.main(args)
+        first, _ = capsys.readouterr()
+        merge.main(args)
+        second, _ = capsys.readouterr()
+
+    assert first == second
+    assert yaml.safe_load(second) == {'web': {'image': 'web', 'command': 'run'}}
+    assert len(tmpdir.join('cache').listdir()) == 2
+
+
+def test_merge_files_to_open_file():
+    output = StringIO()
+    merge.merge_files(
+        StringIO("web: {image: web}\n"),
+        [StringIO("web: {command: run}\n")],
+        output)
+    assert yaml.safe_load(output.getvalue()) == {
+        'web': {'image': 'web', 'command': 'run'}}
+
+
+class TestMergeMatrix(object):
+
+    base = {'web': {'image': 'web', 'environment': {'A': '1'}}, 'db': {}}
+    layers = {
+        'shared': {'web': {'environment': {'B': '2'}}},
+        'dev': {'web': {'volumes': ['.:/code']}},
+        'test': {'web': {'command': 'test'}},
+        'perf': {'db': {'image': 'db'}},
+    }
+    targets = {
+        'dev': ['shared', 'dev'],
+        'test': ['shared', 'test'],
+        'perf': ['perf'],
+        'base': [],
+    }
+
+    def test_same_result_as_merge_configs(self):
+        configs = merge.merge_matrix(self.base, self.layers, self.targets)
+        assert sorted(configs) == ['base', 'dev', 'perf', 'test']
+        for target, names in self.targets.items():
+            assert configs[target] == merge.merge_configs(
+                self.base, [self.layers[name] for name in names])
+
+    def test_shared_layers_are_merged_once(self):
+        with mock.patch(
+            'compose_addons.merge.merge_configs',
+            autospec=True,
+            side_effect=merge.merge_configs,
+        ) as mock_merge:
+            configs = merge.merge_matrix(self.base, self.layers, self.targets)
+
+        merged = [call[0][1] for call in mock_merge.call_args_list]
+        assert merged.count([self.layers['shared']]) == 1
+        assert configs['dev']['db'] is self.base['db']
+        assert configs['base'] is self.base
+
+
+@pytest.mark.acceptance
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_merge_matrix_end_to_end(tmpdir, jobs):
+    tmpdir.join('base.yml').write("web: {image: web}\n")
+    tmpdir.join('shared.yml').write("web: {environment: [A=1]}\n")
+    tmpdir.join('dev.yml').write("web: {volumes: ['.:/code']}\n")
+    tmpdir.join('matrix.yml').write(textwrap.dedent("""
+        dev: [shared.yml, dev.yml]
+        test: [shared.yml]
+    """))
+
+    with tmpdir.as_cwd():
+        merge.main([
+            '--matrix', 'matrix.yml', '--output-dir', 'out', '-j', jobs,
+            'base.yml',
+        ])
+
+    assert yaml.safe_load(tmpdir.join('out', 'dev.yml').read()) == {
+        'web': {'image': 'web', 'environment': ['A=1'], 'volumes': ['.:/code']},
+    }
+    assert yaml.safe_load(tmpdir.join('out', 'test.yml').read()) == {
+        'web': {'image': 'web', 'environment': ['A=1']},
+    }
+
+
+def test_read_matrix_invalid(tmpdir):
+    tmpdir.join('matrix.yml').write("dev: shared.yml\n")
+    with tmpdir.join('matrix.yml').open() as fh:
+        with pytest.raises(ValueError) as exc:
+            merge.read_matrix(fh)
+    assert "target dev must be a list of files" in str(exc.value)
+
+
+@pytest.mark.parametrize('target', ['../x', 'a/b', '.hidden', '1', 'null'])
+def test_read_matrix_invalid_target_name(tmpdir, target):
+    tmpdir.join('matrix.yml').write("%s: [shared.yml]\n" % target)
+    with tmpdir.join('matrix.yml').open() as fh:
+        with pytest.raises(ValueError) as exc:
+            merge.read_matrix(fh)
+    assert "invalid target name" in str(exc.value)
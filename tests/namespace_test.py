@@ -1,3 +1,5 @@
+import os
+
 import pytest
 import yaml
 
@@ -45,35 +47,50 @@ def test_add_namespace():
     assert result == expected
 
 
-def test_parse_field_exact():
-    assert namespace.parse_field('a:b:c:d', 4) == ['a', 'b', 'c', 'd']
+def test_rename_references_links():
+    service = {'links': ['db', 'db:alias', 'cache:a:b', 'ext.web']}
+    names = {'db': 'ns.db', 'cache': 'ns.cache'}
+    assert namespace.rename_references(service, names) == {
+        'links': ['ns.db:db', 'ns.db:alias', 'ns.cache:a:b', 'ext.web']}
+
+
+def test_rename_references_volumes_from():
+    service = {'volumes_from': ['config', 'data:ro', 'ext.config']}
+    names = {'config': 'ns.config', 'data': 'ns.data'}
+    assert namespace.rename_references(service, names) == {
+        'volumes_from': ['ns.config', 'ns.data:ro', 'ext.config']}
 
 
-def test_parse_field_under():
-    assert namespace.parse_field('a', 3) == ['a', None, None]
-    assert namespace.parse_field('a:b', 3) == ['a', 'b', None]
+def test_service_references():
+    service = {
+        'links': ['db:alias', 'cache'],
+        'volumes_from': ['config:ro', 'data'],
+        'net': 'container:proxy',
+    }
+    assert namespace.service_references(service) == [
+        'db', 'cache', 'config', 'data', 'proxy']
 
 
-def test_parse_field_over():
-    assert namespace.parse_field('a:b:c:d', 2) == ['a', 'b:c:d']
+def test_service_references_none():
+    assert namespace.service_references({'net': 'host'}) == []
 
 
-def test_namespace_net_not_container():
-    service = orig = {'net': 'host'}
-    namespace.namespace_net(service, 'namespace', {'host'})
-    assert service == orig
+def test_rename_references_net_not_container():
+    service = {'net': 'host'}
+    assert namespace.rename_references(service, {'host': 'ns.host'}) == {
+        'net': 'host'}
 
 
-def test_namespace_net_external_service():
-    service = orig = {'net': 'container:ext.foo'}
-    namespace.namespace_net(service, 'namespace', {'db', 'config'})
-    assert service == orig
+def test_rename_references_net_external_service():
+    service = {'net': 'container:ext.foo'}
+    assert namespace.rename_references(service, {'db': 'ns.db'}) == {
+        'net': 'container:ext.foo'}
 
 
-def test_namespace_net_internal_service():
+def test_rename_references_net_internal_service():
     service = {'net': 'container:db'}
-    namespace.namespace_net(service, 'namespace.', {'db', 'config'})
-    assert service == {'net': 'container:namespace.db'}
+    assert namespace.rename_references(service, {'db': 'ns.db'}) == {
+        'net': 'container:ns.db'}
 
 
 @pytest.mark.acceptance
@@ -108,4 +125,154 @@ def test_namespace_end_to_end(tmpdir):
 
     with tmpdir.as_cwd():
         namespace.main(args=['-o', 'out.yml', 'docker-compose.yml', 'servicea'])
-    assert yaml.load(tmpdir.join('out.yml').read()) == expected
+    assert yaml.safe_load(tmpdir.join('out.yml').read()) == expected
+
+
+def write_service_files(tmpdir, names):
+    for name in names:
+        tmpdir.join(name + '.yml').write("""
+            web:
+                image: example/%s:latest
+                links: [db]
+            db:
+                image: example/db:latest
+        """ % name)
+
+
+@pytest.mark.acceptance
+def test_namespace_batch_end_to_end(tmpdir, capsys):
+    write_service_files(tmpdir, ['a', 'b', 'c'])
+    tmpdir.join('manifest').write(
+        "# file namespace output\n"
+        "\n"
+        "c.yml servicec out-c.yml\n")
+
+    with tmpdir.as_cwd():
+        result = namespace.main(args=[
+            '--batch', 'a.yml', 'servicea', 'out-a.yml',
+            '--batch', 'b.yml', 'serviceb', 'out-b.yml',
+            '--manifest', 'manifest',
+            '--jobs', '2',
+        ])
+    assert not result
+
+    for name in ['a', 'b', 'c']:
+        config = yaml.safe_load(tmpdir.join('out-%s.yml' % name).read())
+        assert config['namespace'] == 'service' + name
+        assert config['service%s.web' % name]['links'] == [
+            'service%s.db:db' % name]
+
+
+def test_namespace_files_reports_errors(tmpdir):
+    write_service_files(tmpdir, ['a'])
+    tmpdir.join('bad.yml').write("web: [")
+    jobs = [
+        (str(tmpdir.join('a.yml')), 'a', str(tmpdir.join('out-a.yml'))),
+        (str(tmpdir.join('bad.yml')), 'b', str(tmpdir.join('out-b.yml'))),
+        (str(tmpdir.join('missing.yml')), 'c', str(tmpdir.join('out-c.yml'))),
+    ]
+
+    failed = namespace.namespace_files(jobs, processes=1)
+    assert [job for job, _ in failed] == jobs[1:]
+    assert 'ParserError' in failed[0][1]
+    assert tmpdir.join('out-a.yml').check()
+
+
+def test_main_batch_failure(tmpdir, capsys):
+    with tmpdir.as_cwd():
+        result = namespace.main(args=['--batch', 'missing.yml', 'a', 'out.yml'])
+    assert result == 1
+    _, err = capsys.readouterr()
+    assert "Failed to namespace missing.yml" in err
+
+
+def test_read_manifest_invalid_line(tmpdir):
+    manifest = tmpdir.join('manifest')
+    manifest.write("a.yml a\n")
+    with pytest.raises(ValueError) as exc:
+        with manifest.open() as fh:
+            list(namespace.read_manifest(fh))
+    expected = '%s:1: expected "file namespace output"' % manifest
+    assert expected in str(exc.value)
+
+
+def test_add_namespace_volumes_from_mode():
+    config = {
+        'web': {'volumes_from': ['config:ro', 'data:rw', 'external']},
+        'config': {},
+        'data': {},
+    }
+    result = namespace.add_namespace(config, 'star')
+    assert result['star.web']['volumes_from'] == [
+        'star.config:ro', 'star.data:rw', 'external']
+
+
+def test_add_namespace_does_not_modify_input():
+    config = {'web': {'links': ['db']}, 'db': {}}
+    namespace.add_namespace(config, 'star')
+    assert config == {'web': {'links': ['db']}, 'db': {}}
+
+
+def test_reference_index():
+    config = {
+        'web': {
+            'links': ['db:alias', 'cache'],
+            'volumes_from': ['config:ro'],
+            'net': 'container:db',
+        },
+        'worker': {'links': ['db']},
+        'namespace': 'a',
+    }
+    index = namespace.ReferenceIndex(config)
+    assert index.referrers == {
+        'db': {'web', 'worker'},
+        'cache': {'web'},
+        'config': {'web'},
+    }
+
+
+def test_reference_index_rename_copies_changed_services():
+    config = {
+        'web': {'links': ['db', 'cache'], 'net': 'container:db'},
+        'worker': {'image': 'worker'},
+    }
+    services = namespace.ReferenceIndex(config).rename(config, {'db': 'a.db'})
+    assert services['web'] == {
+        'links': ['a.db:db', 'cache'],
+        'net': 'container:a.db',
+    }
+    assert services['worker'] is config['worker']
+    assert config['web'] == {'links': ['db', 'cache'], 'net': 'container:db'}
+
+
+@pytest.mark.acceptance
+def test_output_is_only_written_when_it_changes(tmpdir, capsys):
+    tmpdir.join('compose.yml').write("web: {image: web, links: [db]}\ndb: {}\n")
+    output = tmpdir.join('out.yml')
+    with tmpdir.as_cwd():
+        namespace.main(['-o', 'out.yml', 'compose.yml', 'star'])
+        os.utime(str(output), (1, 1))
+        namespace.main(['-o', 'out.yml', 'compose.yml', 'star'])
+        assert output.mtime() == 1
+
+        namespace.main(['-o', 'out.yml', '--diff', 'compose.yml', 'other'])
+    out, _ = capsys.readouterr()
+    assert [line.split()[:2] for line in out.splitlines()] == [
+        ['added', 'other.db'],
+        ['added', 'other.web'],
+        ['removed', 'star.db'],
+        ['removed', 'star.web'],
+    ]
+    assert output.mtime() == 1
+
+
+@pytest.mark.parametrize('args', [
+    ['compose.yml'],
+    ['compose.yml', '--batch', 'compose.yml', 'ns', 'out.yml'],
+    [],
+])
+def test_get_args_requires_file_and_namespace(tmpdir, args):
+    tmpdir.join('compose.yml').write('web: {}\n')
+    with tmpdir.as_cwd():
+        with pytest.raises(SystemExit):
+            namespace.get_args(args)
@@ -0,0 +1,98 @@
+import mock
+import pytest
+import yaml
+
+from compose_addons import cli
+from compose_addons import pipeline
+
+
+@pytest.fixture
+def config():
+    return {
+        'web': {'build': '.', 'links': ['db']},
+        'db': {'image': 'db:latest'},
+    }
+
+
+def test_pipeline_namespace_and_merge(config):
+    result = pipeline.pipeline(
+        config,
+        namespace='ns',
+        overrides=[{'ns.web': {'image': 'web:latest'}}])
+    assert result == {
+        'namespace': 'ns',
+        'ns.web': {'image': 'web:latest', 'links': ['ns.db:db']},
+        'ns.db': {'image': 'db:latest'},
+    }
+
+
+def test_pipeline_include(config):
+    config['include'] = ['http://example.com/a.yml']
+    with mock.patch(
+        'compose_addons.includes.fetch_external_config',
+        autospec=True,
+        return_value={'namespace': 'a', 'a.api': {'image': 'a'}},
+    ):
+        result = pipeline.pipeline(config, include=True)
+    assert result == {
+        'web': {'build': '.', 'links': ['db']},
+        'db': {'image': 'db:latest'},
+        'a.api': {'image': 'a'},
+    }
+
+
+def test_pipeline_no_stages(config):
+    assert pipeline.pipeline(config) == config
+
+
+def test_get_args_requires_a_stage(tmpdir):
+    tmpdir.join('compose.yml').write('web: {}')
+    with tmpdir.as_cwd():
+        with pytest.raises(SystemExit):
+            pipeline.get_args(['compose.yml'])
+
+
+@pytest.mark.acceptance
+def test_pipeline_end_to_end(tmpdir, capsys):
+    tmpdir.join('compose.yml').write("""
+        include: ['./a.yml']
+        web:
+            build: .
+            links: ['db', 'a.api']
+        db:
+            image: example/db:latest
+    """)
+    tmpdir.join('a.yml').write("""
+        namespace: a
+        a.api:
+            image: example/a:latest
+    """)
+    tmpdir.join('overrides.yml').write("""
+        core.web:
+            image: example/web:latest
+    """)
+
+    with tmpdir.as_cwd():
+        cli.main([
+            'pipeline', '--include', '--namespace', 'core',
+            '--merge', 'overrides.yml', 'compose.yml',
+        ])
+    out, _ = capsys.readouterr()
+
+    assert yaml.safe_load(out) == {
+        'namespace': 'core',
+        'core.web': {
+            'image': 'example/web:latest',
+            'links': ['core.db:db', 'core.a.api:a.api'],
+        },
+        'core.db': {'image': 'example/db:latest'},
+        'core.a.api': {'image': 'example/a:latest'},
+    }
+
+
+def test_cli_runs_command(tmpdir, capsys):
+    tmpdir.join('compose.yml').write('web: {}')
+    with tmpdir.as_cwd():
+        cli.main(['namespace', 'compose.yml', 'ns'])
+    out, _ = capsys.readouterr()
+    assert yaml.safe_load(out) == {'namespace': 'ns', 'ns.web': {}}
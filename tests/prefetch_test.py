@@ -0,0 +1,57 @@
+import pytest
+
+from compose_addons import cli
+from compose_addons import prefetch
+from compose_addons.includes import normalize_url
+
+
+@pytest.fixture
+def compositions(tmpdir):
+    tmpdir.join('a.yml').write("""
+        include: ['b.yml', 'c.yml']
+        web: {image: web}
+    """)
+    tmpdir.join('b.yml').write("""
+        namespace: b
+        include: ['d.yml']
+        b.api: {image: api}
+    """)
+    tmpdir.join('c.yml').write("namespace: c\nc.db: {image: db}\n")
+    tmpdir.join('d.yml').write("namespace: d\nd.db: {image: db}\n")
+    tmpdir.join('other.yml').write("include: ['c.yml']\n")
+    return tmpdir
+
+
+def fetched(cache):
+    return sorted(url.path.rsplit('/', 1)[-1] for url in cache.cache)
+
+
+def test_prefetch(compositions):
+    with compositions.as_cwd():
+        cache, failed = prefetch.prefetch(['a.yml', 'other.yml'], {'jobs': 4})
+    assert fetched(cache) == ['a.yml', 'b.yml', 'c.yml', 'd.yml', 'other.yml']
+    assert failed == {}
+
+
+def test_prefetch_missing_include(compositions):
+    compositions.join('b.yml').remove()
+    with compositions.as_cwd():
+        cache, failed = prefetch.prefetch(['a.yml'], {})
+        url = normalize_url('b.yml').geturl()
+    assert fetched(cache) == ['a.yml', 'b.yml', 'c.yml']
+    assert list(failed) == [url]
+    assert 'No such file' in failed[url]
+
+
+@pytest.mark.acceptance
+def test_prefetch_fills_parse_cache(compositions, capsys):
+    with compositions.as_cwd():
+        assert cli.main(['prefetch', '--parse-cache', 'parsed', 'a.yml']) is None
+    _, err = capsys.readouterr()
+    assert err == "Fetched 4 configs\n"
+    assert len(compositions.join('parsed').listdir()) == 4
+
+
+def test_get_args_requires_a_cache():
+    with pytest.raises(SystemExit):
+        prefetch.get_args(['a.yml'])
@@ -0,0 +1,169 @@
+import socket
+import threading
+
+import mock
+import pytest
+import yaml
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen
+
+from compose_addons import serve
+
+
+INCLUDED = {
+    'namespace': 'a',
+    'a.web': {'image': 'a'},
+}
+
+
+@pytest.fixture
+def mock_fetch():
+    with mock.patch(
+        'compose_addons.serve.fetch_external_config',
+        autospec=True,
+        side_effect=lambda *args, **kwargs: dict(INCLUDED),
+    ) as mock_fetch:
+        yield mock_fetch
+
+
+@pytest.fixture
+def renderer():
+    return serve.Renderer({}, config_ttl=60)
+
+
+def test_renderer_shares_fetched_configs(renderer, mock_fetch):
+    for _ in range(3):
+        config = renderer.handle(
+            '/include', {}, b"include: ['http://example.com/a.yml']\nweb: {}")
+        assert config == {'web': {}, 'a.web': {'image': 'a'}}
+    assert mock_fetch.call_count == 1
+
+
+def test_renderer_fetches_expired_configs(renderer, mock_fetch):
+    renderer.config_ttl = 0
+    body = b"include: ['http://example.com/a.yml']\nweb: {}"
+    renderer.handle('/include', {}, body)
+    renderer.handle('/include', {}, body)
+    assert mock_fetch.call_count == 2
+
+
+def test_renderer_include_services(renderer, mock_fetch):
+    body = b"include: ['http://example.com/a.yml']\nweb: {}\nother: {}"
+    config = renderer.handle('/include', {'services': ['web']}, body)
+    assert config == {'web': {}}
+    # The shared config was not modified by the selection
+    assert renderer.handle('/include', {}, body) == {
+        'web': {}, 'other': {}, 'a.web': {'image': 'a'}}
+
+
+def test_renderer_include_relative_to_dir(renderer, tmpdir):
+    tmpdir.join('a.yml').write("namespace: a\na.web: {image: v1}\n")
+    body = b"include: ['./a.yml']\nweb: {}"
+    config = renderer.handle('/include', {'dir': [str(tmpdir)]}, body)
+    assert config == {'web': {}, 'a.web': {'image': 'v1'}}
+
+
+def test_renderer_include_dir_must_be_absolute(renderer):
+    with pytest.raises(serve.RequestError):
+        renderer.handle('/include', {'dir': ['relative']}, b"web: {}")
+
+
+def test_renderer_reads_local_includes_every_request(renderer, tmpdir):
+    included = tmpdir.join('a.yml')
+    included.write("namespace: a\na.web: {image: v1}\n")
+    body = ("include: ['%s']\nweb: {}" % included).encode('utf-8')
+    assert renderer.handle('/include', {}, body)['a.web'] == {'image': 'v1'}
+
+    included.write("namespace: a\na.web: {image: v2}\n")
+    assert renderer.handle('/include', {}, body)['a.web'] == {'image': 'v2'}
+    assert renderer.configs == {}
+
+
+def test_renderer_namespace(renderer):
+    config = renderer.handle(
+        '/namespace', {'namespace': ['ns']}, b"web: {links: [db]}\ndb: {}")
+    assert config == {
+        'namespace': 'ns',
+        'ns.web': {'links': ['ns.db:db']},
+        'ns.db': {},
+    }
+
+
+def test_renderer_namespace_missing_parameter(renderer):
+    with pytest.raises(serve.RequestError):
+        renderer.handle('/namespace', {}, b"web: {}")
+
+
+def test_renderer_merge(renderer):
+    body = b"web: {build: .}\n---\nweb: {image: web}\n---\ndb: {image: db}"
+    assert renderer.handle('/merge', {}, body) == {
+        'web': {'image': 'web'},
+        'db': {'image': 'db'},
+    }
+
+
+def test_renderer_unknown_path(renderer):
+    assert renderer.handle('/bogus', {}, b"") is None
+
+
+@pytest.fixture
+def http_server(renderer):
+    server = serve.build_server(renderer, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%s' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_server_include(http_server, mock_fetch):
+    response = urlopen(
+        http_server + '/include',
+        b"include: ['http://example.com/a.yml']\nweb: {}")
+    assert response.getcode() == 200
+    assert yaml.safe_load(response.read()) == {
+        'web': {}, 'a.web': {'image': 'a'}}
+
+
+@pytest.mark.parametrize('path, body, code', [
+    ('/bogus', b"web: {}", 404),
+    ('/include', b"web: [", 400),
+    ('/include', b"include: ['bogus://a.yml']", 400),
+    ('/include?dir=/does/not/exist', b"include: ['./a.yml']", 400),
+])
+def test_http_server_errors(http_server, path, body, code):
+    with pytest.raises(HTTPError) as exc:
+        urlopen(http_server + path, body)
+    assert exc.value.code == code
+
+
+def test_unix_socket_server(renderer, tmpdir):
+    socket_path = str(tmpdir.join('dcao.sock'))
+    server = serve.build_server(renderer, socket_path=socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    body = b"web: {links: [db]}\ndb: {}"
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(
+            b"POST /namespace?namespace=ns HTTP/1.0\r\n"
+            b"Content-Length: " + str(len(body)).encode('ascii') + b"\r\n"
+            b"\r\n" + body)
+        response = b''
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            response += data
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    headers, content = response.split(b'\r\n\r\n', 1)
+    assert headers.startswith(b'HTTP/1.0 200')
+    assert yaml.safe_load(content)['ns.web'] == {'links': ['ns.db:db']}
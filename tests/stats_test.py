@@ -0,0 +1,116 @@
+import json
+
+import mock
+import pytest
+
+from compose_addons import includes
+from compose_addons import stats
+
+
+def make_event(url, depth=1, cache=None, **fields):
+    event = {
+        'url': url,
+        'depth': depth,
+        'seconds': 0.5,
+        'bytes': 100,
+        'parse_seconds': 0.25,
+        'cache': cache,
+    }
+    event.update(fields)
+    return event
+
+
+@pytest.fixture
+def collector():
+    collector = stats.StatsCollector()
+    collector.fetched(make_event('http://example.com/b.yml', depth=2))
+    collector.fetched(make_event('http://example.com/a.yml', cache='hit'))
+    collector.fetched(make_event('s3://bucket/c.yml', cache='miss', bytes=50))
+    collector.phase('merge', 0.5)
+    collector.phase('merge', 0.25)
+    return collector
+
+
+def test_stats_collector_totals(collector):
+    assert collector.totals() == {
+        'includes': 3,
+        'bytes': 250,
+        'fetch_seconds': 1.5,
+        'parse_seconds': 0.75,
+        'cache_hits': 1,
+        'cache_misses': 1,
+        'merge': 0.75,
+    }
+
+
+def test_stats_collector_as_dict_sorted_by_depth(collector):
+    urls = [fetch['url'] for fetch in collector.as_dict()['fetches']]
+    assert urls == [
+        'http://example.com/a.yml',
+        's3://bucket/c.yml',
+        'http://example.com/b.yml',
+    ]
+
+
+def test_stats_collector_format_json(collector):
+    assert json.loads(collector.format_json()) == collector.as_dict()
+
+
+def test_stats_collector_format_text(collector):
+    lines = collector.format_text().splitlines()
+    assert lines[1].split() == [
+        '1', '0.500s', '0.250s', '100', 'hit', 'http://example.com/a.yml']
+    assert 'includes: 3, bytes: 250, cache hits: 1, cache misses: 1' in lines
+    assert 'merge: 0.750s' in lines
+
+
+def test_timed():
+    hook = mock.Mock()
+    with stats.timed([hook], 'write'):
+        pass
+    hook.phase.assert_called_once_with('write', mock.ANY)
+
+
+def test_load_hook():
+    assert isinstance(
+        stats.load_hook('compose_addons.stats:StatsCollector'),
+        stats.StatsCollector)
+
+
+def test_load_hook_invalid():
+    with pytest.raises(ValueError):
+        stats.load_hook('compose_addons.stats')
+
+
+def test_include_sends_events(tmpdir):
+    tmpdir.join('a.yml').write("namespace: a\ninclude: ['%s']\na.web: {}\n" % (
+        tmpdir.join('b.yml')))
+    tmpdir.join('b.yml').write("namespace: b\nb.web: {}\n")
+    collector = stats.StatsCollector()
+
+    includes.include(
+        {'include': [str(tmpdir.join('a.yml'))]},
+        {'jobs': 2},
+        hooks=[collector])
+
+    depths = dict(
+        (fetch['url'].rsplit('/', 1)[-1], fetch['depth'])
+        for fetch in collector.fetches)
+    assert depths == {'a.yml': 1, 'b.yml': 2}
+    assert collector.fetches[1]['bytes'] == len(tmpdir.join('b.yml').read())
+    assert set(collector.phases) == {'fetch', 'merge'}
+
+
+@pytest.mark.acceptance
+def test_include_stats_end_to_end(tmpdir, capsys):
+    tmpdir.join('compose.yml').write("include: ['./a.yml']\nweb: {}\n")
+    tmpdir.join('a.yml').write("namespace: a\na.web: {}\n")
+
+    with tmpdir.as_cwd():
+        includes.main(args=['--stats', 'json', 'compose.yml'])
+    _, err = capsys.readouterr()
+
+    result = json.loads(err)
+    assert [fetch['depth'] for fetch in result['fetches']] == [1]
+    assert result['totals']['includes'] == 1
+    assert set(['fetch', 'merge', 'write']) <= set(result['totals'])
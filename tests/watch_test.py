@@ -0,0 +1,171 @@
+import os
+
+import mock
+import pytest
+import yaml
+
+from compose_addons import includes
+from compose_addons import watch
+
+
+@pytest.fixture
+def composition(tmpdir):
+    tmpdir.join('compose.yml').write("""
+        include: ['%s']
+        web:
+            image: example/web:latest
+            links: ['a.api']
+    """ % tmpdir.join('a.yml'))
+    tmpdir.join('a.yml').write("""
+        namespace: a
+        include: ['%s']
+        a.api:
+            image: example/a:latest
+    """ % tmpdir.join('b.yml'))
+    tmpdir.join('b.yml').write("""
+        namespace: b
+        b.db:
+            image: example/b:latest
+    """)
+    return tmpdir
+
+
+@pytest.fixture
+def renderer(composition):
+    return watch.Renderer(
+        str(composition.join('compose.yml')),
+        str(composition.join('out.yml')),
+        {})
+
+
+def read_output(composition):
+    return yaml.safe_load(composition.join('out.yml').read())
+
+
+def test_renderer_paths(renderer, composition):
+    renderer.render()
+    assert renderer.paths() == set(
+        str(composition.join(name)) for name in ['compose.yml', 'a.yml', 'b.yml'])
+
+
+def test_renderer_only_reads_changed_file(renderer, composition):
+    renderer.render()
+    assert read_output(composition)['b.db'] == {'image': 'example/b:latest'}
+
+    composition.join('b.yml').write("""
+        namespace: b
+        b.db:
+            image: example/b:v2
+    """)
+    renderer.invalidate(set([str(composition.join('b.yml'))]))
+    assert renderer.cache.resolved == {}
+
+    with mock.patch(
+        'compose_addons.includes.get_project_from_file',
+        wraps=includes.get_project_from_file,
+    ) as mock_get_project:
+        renderer.render()
+
+    assert read_output(composition)['b.db'] == {'image': 'example/b:v2'}
+    assert [
+        os.path.basename(call[0][0].path)
+        for call in mock_get_project.call_args_list
+    ] == ['b.yml']
+
+
+def test_renderer_services_after_nested_change(composition):
+    composition.join('a.yml').write("""
+        namespace: a
+        include: ['%s']
+        a.api:
+            image: example/a:latest
+            links: ['b.db']
+    """ % composition.join('b.yml'))
+    renderer = watch.Renderer(
+        str(composition.join('compose.yml')),
+        str(composition.join('out.yml')),
+        {},
+        services=['web'])
+    renderer.render()
+    assert read_output(composition)['b.db'] == {'image': 'example/b:latest'}
+
+    composition.join('b.yml').write("""
+        namespace: b
+        b.db:
+            image: example/b:v2
+    """)
+    renderer.invalidate(set([str(composition.join('b.yml'))]))
+    renderer.render()
+    assert read_output(composition)['b.db'] == {'image': 'example/b:v2'}
+
+
+def test_renderer_services_needs_pruned_include(composition):
+    renderer = watch.Renderer(
+        str(composition.join('compose.yml')),
+        str(composition.join('out.yml')),
+        {},
+        services=['web'])
+    renderer.render()
+    assert sorted(read_output(composition)) == ['a.api', 'web']
+
+    composition.join('compose.yml').write("""
+        include: ['%s']
+        web:
+            image: example/web:latest
+            links: ['a.api', 'b.db']
+    """ % composition.join('a.yml'))
+    renderer.invalidate(set([str(composition.join('compose.yml'))]))
+    renderer.render()
+    assert sorted(read_output(composition)) == ['a.api', 'b.db', 'web']
+
+
+def test_renderer_only_keeps_current_parsed_configs(renderer, composition):
+    renderer.render()
+    for version in range(5):
+        composition.join('b.yml').write("""
+            namespace: b
+            b.db:
+                image: example/b:%s
+        """ % version)
+        renderer.invalidate(set([str(composition.join('b.yml'))]))
+        renderer.render()
+    # a.yml and the current b.yml, the compose file is not read by the context
+    assert len(renderer.cache.context.parsed) == 2
+
+
+def test_renderer_keeps_failed_paths_pending(renderer, composition):
+    renderer.render()
+    path = str(composition.join('a.yml'))
+    composition.join('a.yml').write("a.api: [")
+    renderer.invalidate(set([path]))
+    with pytest.raises(yaml.YAMLError):
+        renderer.render()
+    assert path in renderer.paths()
+
+
+@pytest.mark.parametrize('option', [
+    ['--diff'],
+    ['--lock', 'compose.lock'],
+    ['--frozen', 'compose.lock'],
+    ['--stats'],
+])
+def test_get_args_watch_conflicts(composition, option, capsys):
+    composition.join('compose.lock').write('')
+    with composition.as_cwd():
+        with pytest.raises(SystemExit):
+            includes.get_args(
+                ['--watch', '-o', 'out.yml', 'compose.yml'] + option)
+    _, err = capsys.readouterr()
+    assert "%s can not be used with --watch" % option[0] in err
+
+
+def test_polling_watcher(tmpdir):
+    path = tmpdir.join('a.yml')
+    path.write('a: 1')
+    watcher = watch.PollingWatcher(interval=0)
+    watcher.mtimes = {str(path): watch.get_mtime(str(path))}
+    assert watcher.poll() == set()
+
+    mtime = os.stat(str(path)).st_mtime
+    os.utime(str(path), (mtime + 10, mtime + 10))
+    assert watcher.wait([str(path)]) == set([str(path)])